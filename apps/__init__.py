@@ -15,6 +15,7 @@ import apps.state
 import apps.search
 import apps.docx
 import apps.pdf
+import apps.export
 import apps.user
 import apps.api
 
@@ -33,6 +34,7 @@ routes = [
     Mount("/search", apps.search.app),
     Mount("/docx", apps.docx.app),
     Mount("/pdf", apps.pdf.app),
+    Mount("/export", apps.export.app),
     Mount("/user", apps.user.app),
     Mount("/api", apps.api.app),
 ]
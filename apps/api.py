@@ -1,9 +1,7 @@
 "API access to books."
 
-import datetime
 import os
 from pathlib import Path
-import tarfile
 
 from fasthtml.common import *
 
@@ -11,6 +9,7 @@ import auth
 import components
 import constants
 from errors import *
+import manifest
 import utils
 
 
@@ -19,24 +18,28 @@ app, rt = components.get_fast_app()
 
 @rt("/")
 def get(request):
-    "Return a JSON dictionary of items {name: modified} for all files."
+    """Return a JSON dictionary of items {name: modified} for all files.
+    Kept unchanged for the sync clients of earlier versions.
+    """
     try:
         auth.allow_admin(request)
     except NotAllowed:
         raise InvalidApiKey
 
-    sourcedir = Path(os.environ["WRITETHATBOOK_DIR"])
-    result = {}
-    for dirpath, dirnames, filenames in os.walk(sourcedir):
-        dirpath = Path(dirpath)
-        for filename in filenames:
-            filepath = dirpath / filename
-            dt = datetime.datetime.fromtimestamp(
-                filepath.stat().st_mtime, tz=datetime.UTC
-            )
-            result[str(filepath.relative_to(sourcedir))] = utils.str_datetime_iso(dt)
+    return {name: entry["modified"] for name, entry in manifest.get_entries().items()}
+
+
+@rt("/files")
+def get(request):
+    """Return a JSON dictionary of items {name: {modified, size, digest}}
+    for all files.
+    """
+    try:
+        auth.allow_admin(request)
+    except NotAllowed:
+        raise InvalidApiKey
 
-    return result
+    return manifest.get_entries()
 
 
 @rt("/download")
@@ -48,16 +51,12 @@ async def post(request):
         raise InvalidApiKey
 
     data = await request.json()
-    buffer = io.BytesIO()
     sourcedir = Path(os.environ["WRITETHATBOOK_DIR"])
-    with tarfile.open(fileobj=buffer, mode="w:gz") as tgzfile:
-        for name in data["files"]:
-            path = sourcedir / name
-            try:
-                tgzfile.add(path, arcname=str(path.relative_to(sourcedir)))
-            except FileNotFoundError:
-                pass
-    return Response(
-        content=buffer.getvalue(),
+    entries = []
+    for name in data["files"]:
+        path = sourcedir / name
+        entries.append((path, str(path.relative_to(sourcedir))))
+    return StreamingResponse(
+        utils.stream_tgz(entries),
         media_type=constants.GZIP_MIMETYPE,
     )
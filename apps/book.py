@@ -97,6 +97,10 @@ async def post(request, title: str, tgzfile: UploadFile):
 def get(request, book: Book):
     "Display book; contents list of sections and texts."
     auth.authorize(request, *auth.book_view, book=book)
+    etag = components.get_etag(request, book.digest, books.get_imgs().digest)
+    response = components.not_modified(request, etag)
+    if response is not None:
+        return response
 
     if auth.authorized(request, *auth.book_edit, book=book):
         tools = [
@@ -184,6 +188,7 @@ def get(request, book: Book):
             cls="container",
         ),
         components.footer(request, book),
+        *components.http_headers(etag, book.modified),
     )
 
 
@@ -195,6 +200,10 @@ def get(request, book: Book, path: str):
         return components.redirect(f"/book/{book}")
 
     item = book[path]
+    etag = components.get_etag(request, book.digest, books.get_imgs().digest)
+    response = components.not_modified(request, etag)
+    if response is not None:
+        return response
 
     neighbours = []
     style = "text-align: center;"
@@ -318,6 +327,7 @@ def get(request, book: Book, path: str):
             cls="container",
         ),
         components.footer(request, item),
+        *components.http_headers(etag, item.modified),
     )
 
 
@@ -340,10 +350,6 @@ def post(request, book: Book, path: str, form: dict):
     elif form["type"] == constants.SECTION:
         new = book.create_section(form["title"], parent=parent)
 
-    # Reread the book, ensuring everything is up to date.
-    book.write()
-    book.read()
-
     return components.redirect(f"/edit/{book}/{new.path}")
 
 
@@ -426,21 +432,22 @@ def get_books_table(request, books):
     "Return a table containing the given books."
     rows = []
     for book in books:
-        owner = users.get(book.owner)
+        summary = book.summary
+        owner = users.get(summary["owner"])
         if auth.authorized(request, *auth.user_view, user=owner):
             owner = A(owner.name or owner.id, href=f"/user/view/{owner}")
         else:
             owner = owner.name or owner.id
         rows.append(
             Tr(
-                Td(A(book.title, href=f"/book/{book.id}")),
-                Td(Tx(book.type.capitalize())),
-                Td(Tx(book.status)),
-                Td(Tx(utils.numerical(book.sum_words)), cls="right"),
-                Td(Tx(utils.numerical(book.sum_characters)), cls="right"),
+                Td(A(summary["title"], href=f"/book/{book.id}")),
+                Td(Tx(summary["type"].capitalize())),
+                Td(Tx(summary["status"])),
+                Td(Tx(utils.numerical(summary["sum_words"])), cls="right"),
+                Td(Tx(utils.numerical(summary["sum_characters"])), cls="right"),
                 Td(owner),
-                Td(Tx(book.public and "Yes" or "No")),
-                Td(utils.str_datetime_display(book.modified)),
+                Td(Tx(summary["public"] and "Yes" or "No")),
+                Td(utils.str_datetime_display(summary["modified"])),
             )
         )
     if rows:
@@ -3,7 +3,11 @@
 import datetime
 import io
 import json
+import os
+from pathlib import Path
+import pickle
 import struct
+import tempfile
 import urllib.parse
 
 import docx
@@ -11,9 +15,9 @@ import docx
 import docx.oxml
 import docx.shared
 import docx.styles.style
+import lxml.etree
 import PIL
 import requests
-import vl_convert
 
 from fasthtml.common import *
 
@@ -23,7 +27,8 @@ from books import Book, get_imgs
 import components
 import constants
 from errors import *
-import minixml
+import exports
+import images
 import users
 import utils
 from utils import Tx
@@ -170,7 +175,7 @@ def get(request, book: Book):
 
 @rt("/{book:Book}")
 def post(request, book: Book, form: dict):
-    "Actually download the book as DOCX file."
+    "Start creating, or download, the book as DOCX file."
     auth.authorize(request, *auth.book_view, book=book)
 
     settings = book.frontmatter.setdefault("docx", {})
@@ -189,11 +194,11 @@ def post(request, book: Book, form: dict):
     if auth.authorized(request, *auth.book_edit, book=book):
         book.write()
 
-    return Response(
-        content=BookWriter(book).get_content(),
-        media_type=constants.DOCX_MIMETYPE,
-        headers={"Content-Disposition": f'attachment; filename="{book.title}.docx"'},
-    )
+    # The file is created by a background job, unless already available.
+    job = exports.submit("docx", book, settings)
+    if job.status == constants.EXPORT_DONE:
+        return components.redirect(f"/export/{job}/download")
+    return components.redirect(f"/export/{job}")
 
 
 @rt("/{book:Book}/{path:path}")
@@ -207,10 +212,19 @@ def get(request, book: Book, path: str, position: int = None):
         raise Error("no DOCX output parameters have been set")
 
     item = book[path]
+    # The output depends also on the references and images used.
+    etag = components.get_etag(
+        request, book.digest, books.get_refs().digest, get_imgs().digest
+    )
+    response = components.not_modified(request, etag)
+    if response is not None:
+        return response
+    headers = components.cache_headers(etag, item.modified)
+    headers["Content-Disposition"] = f'attachment; filename="{item.title}.docx"'
     return Response(
         content=ItemWriter(book).get_content(item),
         media_type=constants.DOCX_MIMETYPE,
-        headers={"Content-Disposition": f'attachment; filename="{item.title}.docx"'},
+        headers=headers,
     )
 
 
@@ -220,9 +234,11 @@ class Writer:
     def __init__(self, book):
         self.book = book
         self.references = books.get_refs()
+        # Function called with (done, total) number of chapters, if any.
+        self.progress = None
 
         # General settings.
-        if book.frontmatter.get("chunk_number"):  # Display paragraph numbers.
+        if book.frontmatter.get("chunk_numbers"):  # Display paragraph numbers.
             self.paragraph_number = 0
         else:
             self.paragraph_number = None
@@ -729,29 +745,11 @@ class Writer:
                     constants.SVG_MIMETYPE,
                     constants.JSON_MIMETYPE,
                 ):
-                    # SVG image.
-                    if img["content_type"] == constants.SVG_MIMETYPE:
-                        # SVG in image library has already been checked for validity.
-                        root = minixml.parse_content(img["data"])
-
-                    # Vega-Lite plot.
-                    else:
-                        # JSON in image library has already been checked for validity.
-                        vl_spec = json.loads(img["data"])
-                        root = minixml.parse_content(
-                            vl_convert.vegalite_to_svg(vl_spec)
-                        )
-
-                    # Set viewbox so that scaling behaves.
-                    root["viewBox"] = f"0 0 {root['width']} {root['height']}"
-
-                    # Scale width and height in SVG element.
+                    # SVG or Vega-Lite in image library has already been checked
+                    # for validity. Rendered to PNG at a higher resolution.
                     rendering_factor = img["docx"]["png_rendering_factor"]
-                    root["width"] = rendering_factor * float(root["width"])
-                    root["height"] = rendering_factor * float(root["height"])
-
                     self.add_image(
-                        vl_convert.svg_to_png(repr(root)),
+                        images.get_png(img, rendering_factor),
                         ast,
                         scale_factor / rendering_factor,
                     )
@@ -761,9 +759,7 @@ class Writer:
                     constants.PNG_MIMETYPE,
                     constants.JPEG_MIMETYPE,
                 ):
-                    self.add_image(
-                        base64.standard_b64decode(img["data"]), ast, scale_factor
-                    )
+                    self.add_image(images.get_data(img), ast, scale_factor)
                 else:
                     raise ValueError(f"Cannot handle image {img['content_type']}")
             else:
@@ -1042,19 +1038,19 @@ class BookWriter(Writer):
             self.document.add_paragraph(Tx("Index"), style="Body Text")
 
         # First-level items are chapters.
-        for item in self.book.items:
+        for count, item in enumerate(self.book.items):
+            if self.progress:
+                self.progress(count, len(self.book.items))
             if item.status == constants.OMITTED:
                 continue
             if item.status < self.include_status:
                 continue
 
-            if item.is_section:
-                self.write_section(item, level=item.level)
-            else:
-                self.write_text(item, level=item.level)
+            self.write_chapter(item)
 
-            if self.footnotes_location == constants.FOOTNOTES_EACH_CHAPTER:
-                self.write_chapter_footnotes(item)
+        if self.progress:
+            self.progress(len(self.book.items), len(self.book.items))
+        cleanup_fragments()
 
         if self.footnotes_location == constants.FOOTNOTES_END_OF_BOOK:
             self.write_book_footnotes()
@@ -1070,6 +1066,119 @@ class BookWriter(Writer):
         self.document.save(output)
         return output.getvalue()
 
+    def write_chapter(self, item):
+        """Write the chapter, reusing its document fragment from the cache
+        if neither the chapter, nor anything it depends on, has changed.
+        """
+        key = self.get_chapter_key(item)
+        fragment = get_fragment(key)
+        if fragment is None:
+            fragment = self.get_chapter_fragment(item)
+            set_fragment(key, fragment)
+        self.add_fragment(fragment)
+
+    def get_chapter_key(self, item):
+        "Return the key for the cached document fragment of the chapter."
+        items = [item, *item]
+        refids = sorted(set().union(*[i.terms["refs"] for i in items]))
+        dests = sorted(set().union(*[i.terms["imgs"] for i in items]))
+        return utils.get_digest(
+            json.dumps(
+                [
+                    constants.__version__,
+                    self.book.language,
+                    self.book.frontmatter.get("docx", {}),
+                    self.paragraph_number,
+                    item.total_digest,
+                    [[i.fulltitle, i.ordinal] for i in items],
+                    [
+                        [r, self.references[r].digest if r in self.references else None]
+                        for r in refids
+                    ],
+                    [
+                        [d, get_imgs()[d].digest if d in get_imgs() else None]
+                        for d in dests
+                    ],
+                ],
+                sort_keys=True,
+            )
+        )
+
+    def get_chapter_fragment(self, item):
+        """Write the chapter into the document and return its fragment:
+        the XML of the body elements, the relationships they use, and
+        the footnotes, references and indexed terms they contain.
+        """
+        body = self.document.element.body
+        start = len(body.xpath("./w:p | ./w:tbl"))
+        saved = self.footnotes, self.referenced, self.indexed
+        self.footnotes, self.referenced, self.indexed = {}, set(), {}
+
+        if item.is_section:
+            self.write_section(item, level=item.level)
+        else:
+            self.write_text(item, level=item.level)
+        if self.footnotes_location == constants.FOOTNOTES_EACH_CHAPTER:
+            self.write_chapter_footnotes(item)
+
+        fragment = dict(
+            elements=[],
+            relationships={},
+            footnotes=self.footnotes,
+            referenced=self.referenced,
+            indexed=self.indexed,
+            paragraph_number=self.paragraph_number,
+        )
+        self.footnotes, self.referenced, self.indexed = saved
+        rels = self.document.part.rels
+        for element in body.xpath("./w:p | ./w:tbl")[start:]:
+            # Remove the elements; they are added back with the fragment.
+            body.remove(element)
+            fragment["elements"].append(lxml.etree.tostring(element))
+            for rid in element.xpath(".//@r:id | .//@r:embed"):
+                rel = rels[rid]
+                if rel.is_external:
+                    fragment["relationships"][rid] = ("hyperlink", rel.target_ref)
+                else:
+                    fragment["relationships"][rid] = ("image", rel.target_part.blob)
+        return fragment
+
+    def add_fragment(self, fragment):
+        """Add the chapter fragment to the document, creating the relationships
+        it requires, and merge its footnotes, references and indexed terms.
+        """
+        part = self.document.part
+        rids = {}
+        for rid, (kind, value) in fragment["relationships"].items():
+            if kind == "hyperlink":
+                rids[rid] = part.relate_to(
+                    value,
+                    docx.opc.constants.RELATIONSHIP_TYPE.HYPERLINK,
+                    is_external=True,
+                )
+            else:
+                rids[rid] = part.get_or_add_image(io.BytesIO(value))[0]
+        sectPr = self.document.element.body.sectPr
+        # Drawing object identifiers must be unique in the document; scan for
+        # the maximum once and number the fragment's drawings from there.
+        next_id = part.next_id
+        for xml in fragment["elements"]:
+            element = docx.oxml.parse_xml(xml)
+            for name in ("r:id", "r:embed"):
+                attribute = docx.oxml.ns.qn(name)
+                for node in element.xpath(f".//*[@{name}]"):
+                    node.set(attribute, rids[node.get(attribute)])
+            for node in element.xpath(".//wp:docPr"):
+                node.set("id", str(next_id))
+                next_id += 1
+            sectPr.addprevious(element)
+
+        self.footnotes.update(fragment["footnotes"])
+        self.referenced.update(fragment["referenced"])
+        for canonical, entries in fragment["indexed"].items():
+            self.indexed.setdefault(canonical, []).extend(entries)
+        self.paragraph_number = fragment["paragraph_number"]
+
 
 class ItemWriter(Writer):
     "DOCX item (section or text) writer."
@@ -1097,3 +1206,44 @@ class ItemWriter(Writer):
         output = io.BytesIO()
         self.document.save(output)
         return output.getvalue()
+
+
+def get_fragments_dirpath():
+    "Return the directory for cached chapter fragments. Create it if necessary."
+    dirpath = (
+        Path(os.environ["WRITETHATBOOK_DIR"])
+        / constants.CACHE
+        / constants.DOCX_CACHE_DIRNAME
+    )
+    dirpath.mkdir(parents=True, exist_ok=True)
+    return dirpath
+
+
+def get_fragment(key):
+    "Return the cached chapter fragment for the key, or None if not cached."
+    filepath = get_fragments_dirpath() / f"{key}.pickle"
+    try:
+        with open(filepath, "rb") as infile:
+            fragment = pickle.load(infile)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return None
+    # Mark as recently used, to be kept at cleanup.
+    filepath.touch()
+    return fragment
+
+
+def set_fragment(key, fragment):
+    "Store the chapter fragment for the key in the cache."
+    dirpath = get_fragments_dirpath()
+    # Write to a temporary file first, so that readers never see a partial file.
+    with tempfile.NamedTemporaryFile(dir=dirpath, delete=False) as outfile:
+        pickle.dump(fragment, outfile)
+    os.replace(outfile.name, dirpath / f"{key}.pickle")
+
+
+def cleanup_fragments():
+    "Remove the least recently used chapter fragments beyond the maximum number."
+    filepaths = list(get_fragments_dirpath().glob("*.pickle"))
+    filepaths.sort(key=lambda f: f.stat().st_mtime, reverse=True)
+    for filepath in filepaths[constants.DOCX_CACHE_SIZE :]:
+        filepath.unlink(missing_ok=True)
@@ -200,9 +200,8 @@ def post(request, book: Book, form: dict):
         content = chunked.content
         href = f"/book/{book}#{nchunk}"
 
-    # Save book content. Reread the book, ensuring everything is up to date.
+    # Save book content.
     book.write(content=content, force=True)
-    book.read()
 
     return components.redirect(href)
 
@@ -223,7 +222,11 @@ def get(request, book: Book, path: str, nchunk: int = None):
             Label(Tx("Subtitle")), Input(name="subtitle", value=item.subtitle or "")
         )
         if item.is_text:
-            item.read()
+            # Get the current content, if the file has been changed outside
+            # of this app. Only the text and the containers above are updated.
+            if not book.reload_path(item.abspath):
+                book = books.get_book(book.id, reread=True)
+                item = book[path]
             fields.append(
                 Div(
                     title_field,
@@ -333,10 +336,9 @@ def post(request, book: Book, path: str, form: dict):
         content = chunked.content
         href = f"/book/{book}/{path}#{nchunk}"
 
-    # Save item. Reread the book, ensuring everything is up to date.
+    # Save item, and the book, since the title of the item may have changed.
     item.write(content=content, force=True)
     book.write()
-    book.read()
 
     # Must use new path, since name may have been changed.
     return components.redirect(href)
@@ -0,0 +1,83 @@
+"Status and download of export jobs for PDF and DOCX files of books."
+
+from fasthtml.common import *
+
+import auth
+import books
+import components
+import constants
+from errors import *
+import exports
+import utils
+from utils import Tx
+
+
+app, rt = components.get_fast_app()
+
+
+def get_job(request, key):
+    "Return the job given its key, if the current user may view the book."
+    job = exports.get_job(key)
+    if job is None:
+        raise Error(f"no such export job '{key}'", HTTP.NOT_FOUND)
+    auth.authorize(request, *auth.book_view, book=books.get_book(job.book_id))
+    return job
+
+
+@rt("/{key}")
+def get(request, key: str):
+    "Display the status of the export job; reload the page until finished."
+    job = get_job(request, key)
+    book = books.get_book(job.book_id)
+
+    status = job.status
+    rows = [
+        Tr(Td(Tx("Book")), Td(A(job.title, href=f"/book/{book}"))),
+        Tr(Td(Tx("File type")), Td(job.kind.upper())),
+        Tr(Td(Tx("Status")), Td(Tx(status))),
+        Tr(Td(Tx("Submitted")), Td(utils.str_datetime_display(job.submitted))),
+    ]
+    progress = job.progress
+    if progress and status == constants.EXPORT_RUNNING:
+        done, total = progress
+        if done < total:
+            rows.append(Tr(Td(Tx("Chapters")), Td(Progress(value=done, max=total))))
+        else:
+            rows.append(Tr(Td(Tx("Chapters")), Td(Tx("Building document"))))
+    if status == constants.EXPORT_FAILED:
+        rows.append(Tr(Td(Tx("Error")), Td(job.error or "-")))
+
+    headers = []
+    if status == constants.EXPORT_DONE:
+        result = A(
+            f'{Tx("Download")} {job.filename}',
+            role="button",
+            href=f"/export/{job}/download",
+        )
+    elif status == constants.EXPORT_FAILED:
+        result = A(Tx("Try again"), role="button", href=f"/{job.kind}/{book}")
+    else:
+        headers.append(Meta(http_equiv="refresh", content=constants.EXPORT_REFRESH))
+        result = P(Tx("This page reloads until the file is ready."))
+
+    title = f'{Tx("Export")} {job.title}'
+    return (
+        Title(title),
+        *headers,
+        components.header(request, title, book=book),
+        Main(Table(Tbody(*rows)), result, cls="container"),
+        components.footer(request, book),
+    )
+
+
+@rt("/{key}/download")
+def get(request, key: str):
+    "Download the exported file."
+    job = get_job(request, key)
+    if job.status != constants.EXPORT_DONE:
+        return components.redirect(f"/export/{job}")
+    return FileResponse(
+        job.filepath,
+        media_type=job.media_type,
+        headers={"Content-Disposition": f'attachment; filename="{job.filename}"'},
+    )
@@ -1,6 +1,5 @@
 "Images list, view, and edit pages."
 
-import base64
 import json
 import os.path
 
@@ -13,6 +12,8 @@ import books
 from books import get_imgs, Text
 import components
 import constants
+from errors import *
+import images
 import markdown
 import minixml
 import utils
@@ -92,12 +93,11 @@ def get(request, img: Text):
 
     # JSON: Vega-Lite specification image.
     elif img["content_type"] == constants.JSON_MIMETYPE:
-        image = NotStr(vl_convert.vegalite_to_svg(json.loads(img["data"])))
+        image = NotStr(images.vegalite_to_svg(img["data"]))
 
     # PNG or JPEG formats.
     else:
-        url = f'data:{img["content_type"]};base64, {img["data"]}'
-        image = Img(src=url, title=img["title"])
+        image = Img(src=f"/imgs/raw/{img['id']}", title=img["title"])
 
     if img.content:
         item = Article(image, Footer(NotStr(markdown.to_html(img.content))))
@@ -293,8 +293,7 @@ async def post(session, request, form: dict):
         constants.PNG_MIMETYPE,
         constants.JPEG_MIMETYPE,
     ):
-        img["data"] = base64.standard_b64encode(image_content).decode("utf-8")
-        img["base64"] = True
+        images.set_data(img, image_content)
     else:
         return Error(f"invalid image file content type '{image_file.content_type}'")
 
@@ -304,6 +303,7 @@ async def post(session, request, form: dict):
         caption = caption.replace("\r", "")
         caption = "\n".join([c for c in caption.split("\n") if c])
     img.write(content=caption)
+    images.convert(img)
 
     return components.redirect(f"/imgs/view/{img['id']}")
 
@@ -517,8 +517,7 @@ async def post(session, request, img: Text, form: dict):
             # Allow changing between PNG and JPEG formats.
             image_content = await image_file.read()
             img["content_type"] = image_file.content_type
-            img["data"] = base64.standard_b64encode(image_content).decode("utf-8")
-            img["base64"] = True
+            images.set_data(img, image_content)
 
     else:
         return Error(f"invalid image file content type '{image_file.content_type}'")
@@ -555,6 +554,7 @@ async def post(session, request, img: Text, form: dict):
         caption = caption.replace("\r", "")
         caption = "\n".join([c for c in caption.split("\n") if c])
     img.write(content=caption)
+    images.convert(img)
 
     return components.redirect(f"/imgs/view/{img['id']}")
 
@@ -588,10 +588,36 @@ def get(request, img: Text):
 def post(request, img: Text):
     "Actually delete the image text item."
     auth.authorize(request, *auth.img_edit, img=img)
+    images.remove_data(img)
     img.delete(force=True)
     return components.redirect("/imgs")
 
 
+@rt("/raw/{img:Img}")
+def get(request, img: Text):
+    """Return the data of the image as such, for use in pages.
+    Anyone may fetch it, as for the download of all images.
+    """
+    auth.allow_anyone(request)
+
+    # The digest of the image includes the digest of any separate data file.
+    etag = f'"{img.digest}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("If-None-Match") == etag:
+        return Response(status_code=HTTP.NOT_MODIFIED, headers=headers)
+
+    if img["content_type"] == constants.SVG_MIMETYPE:
+        content = img["data"]
+        media_type = constants.SVG_MIMETYPE
+    elif img["content_type"] == constants.JSON_MIMETYPE:
+        content = images.vegalite_to_svg(img["data"])
+        media_type = constants.SVG_MIMETYPE
+    else:
+        content = images.get_data(img)
+        media_type = img["content_type"]
+    return Response(content=content, media_type=media_type, headers=headers)
+
+
 @rt("/download")
 def get(request):
     "Download a gzipped tar file of all the images."
@@ -599,8 +625,8 @@ def get(request):
 
     filename = f"writethatbook_imgs_{utils.str_datetime_safe()}.tgz"
 
-    return Response(
-        content=get_imgs().get_tgz_content(),
+    return StreamingResponse(
+        utils.stream_tgz(get_imgs().get_tgz_entries()),
         media_type=constants.GZIP_MIMETYPE,
         headers={"Content-Disposition": f'attachment; filename="{filename}"'},
     )
@@ -18,6 +18,7 @@ from books import Book, get_books, get_refs
 import components
 import constants
 from errors import *
+import manifest
 import users
 import utils
 from utils import Tx
@@ -32,12 +33,7 @@ def get(request):
     auth.allow_admin(request)
 
     disk_usage = shutil.disk_usage(os.environ["WRITETHATBOOK_DIR"])
-    dir_size = 0
-    for dirpath, dirnames, filenames in os.walk(os.environ["WRITETHATBOOK_DIR"]):
-        dp = Path(dirpath)
-        for filename in filenames:
-            fp = dp / filename
-            dir_size += os.path.getsize(fp)
+    dir_size = manifest.get_total_size()
 
     usage = Table(
         Thead(Tr(Th(Tx("Resource usage"), Th(Tx("Bytes or #"), cls="right")))),
@@ -117,6 +113,10 @@ def get(request):
 def get(request, book: Book):
     "Display the indexed terms of the book."
     auth.authorize(request, *auth.book_view, book=book)
+    etag = components.get_etag(request, book.digest)
+    response = components.not_modified(request, etag)
+    if response is not None:
+        return response
 
     items = []
     for key, texts in sorted(book.indexed.items(), key=lambda tu: tu[0].casefold()):
@@ -139,6 +139,7 @@ def get(request, book: Book):
         components.header(request, title, book=book),
         Main(Ul(*items), cls="container"),
         components.footer(request),
+        *components.http_headers(etag, book.modified),
     )
 
 
@@ -146,6 +147,10 @@ def get(request, book: Book):
 def get(request, book: Book):
     "Display the most recently modified items in the book."
     auth.authorize(request, *auth.book_view, book=book)
+    etag = components.get_etag(request, book.digest)
+    response = components.not_modified(request, etag)
+    if response is not None:
+        return response
 
     items = sorted(list(book), key=lambda i: i.modified, reverse=True)
     items = items[: constants.MAX_RECENT]
@@ -167,6 +172,7 @@ def get(request, book: Book):
             cls="container",
         ),
         components.footer(request),
+        *components.http_headers(etag, book.modified),
     )
 
 
@@ -174,6 +180,10 @@ def get(request, book: Book):
 def get(request, book: Book):
     "Display information about the book."
     auth.authorize(request, *auth.book_view, book=book)
+    etag = components.get_etag(request, book.digest, users.get(book.owner).name or "")
+    response = components.not_modified(request, etag)
+    if response is not None:
+        return response
 
     segments = [H3(book.title)]
     if book.subtitle:
@@ -205,6 +215,7 @@ def get(request, book: Book):
         components.header(request, title, book=book),
         Main(*segments, cls="container"),
         components.footer(request),
+        *components.http_headers(etag, book.modified),
     )
 
 
@@ -212,6 +223,10 @@ def get(request, book: Book):
 def get(request, book: Book):
     "List each status and texts of the book in it."
     auth.authorize(request, *auth.book_view, book=book)
+    etag = components.get_etag(request, book.digest)
+    response = components.not_modified(request, etag)
+    if response is not None:
+        return response
 
     rows = [
         Tr(
@@ -262,4 +277,5 @@ def get(request, book: Book):
         components.header(request, title, book=book),
         Main(Table(cls="striped", *rows), cls="container"),
         components.footer(request),
+        *components.http_headers(etag, book.modified),
     )
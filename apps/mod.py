@@ -52,9 +52,8 @@ def post(request, book: Book, path: str, content: str):
     old_content, footnotes = item.split_footnotes()
     item.write(content=old_content + "\n" + content + "\n\n" + footnotes)
 
-    # Write out and reread the book, ensuring everything is up to date.
+    # Write out the book, since the digest of the item has changed.
     book.write()
-    book.read()
 
     return components.redirect(f"/book/{book}/{path}")  # This works for book.
 
@@ -1,9 +1,10 @@
 "Create PDF file of book or item using the ReportLab package."
 
-import base64
+import concurrent.futures
 import datetime
 import io
-import json
+import multiprocessing
+import threading
 import urllib.parse
 
 import reportlab
@@ -18,7 +19,6 @@ from reportlab.platypus.tableofcontents import TableOfContents, SimpleIndex
 import PIL
 import requests
 import svglib.svglib
-import vl_convert
 
 from fasthtml.common import *
 
@@ -28,7 +28,8 @@ from books import Book, get_imgs
 import components
 import constants
 from errors import *
-import minixml
+import exports
+import images
 import users
 import utils
 from utils import Tx
@@ -36,6 +37,11 @@ from utils import Tx
 
 app, rt = components.get_fast_app()
 
+# ReportLab sets some class attributes of KeepTogether when the first instance
+# is created. Ensure this is done here, since the instances unpickled from the
+# chapter worker processes may otherwise be the first ones in this process.
+KeepTogether([])
+
 
 @rt("/{book:Book}")
 def get(request, book: Book):
@@ -179,7 +185,7 @@ def get(request, book: Book):
 
 @rt("/{book:Book}")
 def post(request, book: Book, form: dict):
-    "Actually download the book as PDF file."
+    "Start creating, or download, the book as PDF file."
     auth.authorize(request, *auth.book_view, book=book)
 
     settings = book.frontmatter.setdefault("pdf", {})
@@ -198,11 +204,11 @@ def post(request, book: Book, form: dict):
     if auth.authorized(request, *auth.book_edit, book=book):
         book.write()
 
-    return Response(
-        content=BookWriter(book).get_content(),
-        media_type=constants.PDF_MIMETYPE,
-        headers={"Content-Disposition": f'attachment; filename="{book.title}.pdf"'},
-    )
+    # The file is created by a background job, unless already available.
+    job = exports.submit("pdf", book, settings)
+    if job.status == constants.EXPORT_DONE:
+        return components.redirect(f"/export/{job}/download")
+    return components.redirect(f"/export/{job}")
 
 
 @rt("/{book:Book}/{path:path}")
@@ -216,10 +222,19 @@ def get(request, book: Book, path: str, position: int = None):
         raise Error("no PDF output parameters have been set")
 
     item = book[path]
+    # The output depends also on the references and images used.
+    etag = components.get_etag(
+        request, book.digest, books.get_refs().digest, get_imgs().digest
+    )
+    response = components.not_modified(request, etag)
+    if response is not None:
+        return response
+    headers = components.cache_headers(etag, item.modified)
+    headers["Content-Disposition"] = f'attachment; filename="{item.title}.pdf"'
     return Response(
         content=ItemWriter(book).get_content(item),
         media_type=constants.PDF_MIMETYPE,
-        headers={"Content-Disposition": f'attachment; filename="{item.title}.pdf"'},
+        headers=headers,
     )
 
 
@@ -229,6 +244,8 @@ class Writer:
     def __init__(self, book):
         self.book = book
         self.references = books.get_refs()
+        # Function called with (done, total) number of chapters, if any.
+        self.progress = None
 
         # General settings.
         if book.frontmatter.get("chunk_numbers"):  # Display paragraph numbers.
@@ -344,6 +361,16 @@ class Writer:
         self.index = SimpleIndex(style=self.stylesheet["Index"], headers=False)
         self.any_indexed = False
 
+    def write_chapter(self, item):
+        "Write the top-level item, and its footnotes if to be output after it."
+        if item.is_section:
+            self.write_section(item, level=1)
+        else:
+            self.write_text(item, level=1)
+
+        if self.footnotes_location == constants.FOOTNOTES_EACH_CHAPTER:
+            self.write_chapter_footnotes(item)
+
     def write_section(self, section, level):
         if section.status == constants.OMITTED:
             return
@@ -664,19 +691,8 @@ class Writer:
                 constants.SVG_MIMETYPE,
                 constants.JSON_MIMETYPE,
             ):
-                # SVG image.
-                if img["content_type"] == constants.SVG_MIMETYPE:
-                    # SVG in image library has already been checked for validity.
-                    root = minixml.parse_content(img["data"])
-
-                # Vega-Lite plot.
-                else:
-                    # JSON in image library has already been checked for validity.
-                    vl_spec = json.loads(img["data"])
-                    root = minixml.parse_content(vl_convert.vegalite_to_svg(vl_spec))
-
-                # Set viewbox so that scaling behaves.
-                root["viewBox"] = f"0 0 {root['width']} {root['height']}"
+                # SVG or Vega-Lite in image library has already been checked.
+                root = images.get_svg_root(img)
 
                 # SVG convert to ReportLab graphics.
                 if img["pdf"]["reportlab_graphics"]:
@@ -685,18 +701,15 @@ class Writer:
                     root["height"] = scale_factor * float(root["height"])
                     flowables.append(svglib.svglib.svg2rlg(io.StringIO(repr(root))))
 
-                # SVG convert to PNG.
+                # SVG convert to PNG, rendered at a higher resolution.
                 else:
                     png_factor = img["pdf"]["png_rendering_factor"]
-                    # Scale width and height in SVG element.
-                    root["width"] = png_factor * scale_factor * float(root["width"])
-                    root["height"] = png_factor * scale_factor * float(root["height"])
                     flowables.append(
                         Image(
-                            io.BytesIO(vl_convert.svg_to_png(repr(root))),
+                            io.BytesIO(images.get_png(img, png_factor * scale_factor)),
                             hAlign="LEFT",
-                            width=float(root["width"]) / png_factor,
-                            height=float(root["height"]) / png_factor,
+                            width=scale_factor * float(root["width"]),
+                            height=scale_factor * float(root["height"]),
                         )
                     )
 
@@ -705,7 +718,7 @@ class Writer:
                 constants.PNG_MIMETYPE,
                 constants.JPEG_MIMETYPE,
             ):
-                image_data = io.BytesIO(base64.standard_b64decode(img["data"]))
+                image_data = io.BytesIO(images.get_data(img))
                 width, height = PIL.Image.open(image_data).size
                 flowables.append(
                     Image(
@@ -1020,19 +1033,29 @@ class BookWriter(Writer):
             self.flowables.append(self.toc)
 
         # First-level items are chapters.
+        chapters = []
         for item in self.book.items:
             if item.status == constants.OMITTED:
                 continue
             if item.status < self.include_status:
                 continue
+            chapters.append(item)
+        # Forking is safe only if this process runs no other threads, as is
+        # the case in the export worker process, but not in the web server.
+        if (
+            len(chapters) > 1
+            and constants.PDF_CHAPTER_WORKERS > 1
+            and threading.active_count() == 1
+        ):
+            self.write_chapters_parallel(chapters)
+        else:
+            for count, item in enumerate(chapters):
+                if self.progress:
+                    self.progress(count, len(chapters))
+                self.write_chapter(item)
 
-            if item.is_section:
-                self.write_section(item, level=1)
-            else:
-                self.write_text(item, level=1)
-
-            if self.footnotes_location == constants.FOOTNOTES_EACH_CHAPTER:
-                self.write_chapter_footnotes(item)
+        if self.progress:
+            self.progress(len(chapters), len(chapters))
 
         if self.footnotes_location == constants.FOOTNOTES_END_OF_BOOK:
             self.write_book_footnotes()
@@ -1080,6 +1103,36 @@ class BookWriter(Writer):
                 document.build(self.flowables, onLaterPages=self.display_page_number)
         return output.getvalue()
 
+    def write_chapters_parallel(self, chapters):
+        """Write the chapters in worker processes, and merge their flowables
+        and other results in order. The paragraph numbers, if displayed,
+        are counted beforehand to give the first number in each chapter.
+        The worker processes are forked, so they have the book as read here.
+        This must be done only in a process which runs no other threads.
+        """
+        paragraph_numbers = []
+        for item in chapters:
+            paragraph_numbers.append(self.paragraph_number)
+            if self.paragraph_number is not None:
+                self.paragraph_number += count_paragraphs(item)
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=min(constants.PDF_CHAPTER_WORKERS, len(chapters)),
+            mp_context=multiprocessing.get_context("fork"),
+        ) as executor:
+            futures = [
+                executor.submit(write_chapter, self.book.id, item.path, number)
+                for item, number in zip(chapters, paragraph_numbers)
+            ]
+            for count, future in enumerate(concurrent.futures.as_completed(futures)):
+                if self.progress:
+                    self.progress(count, len(chapters))
+            for future in futures:
+                result = future.result()
+                self.flowables.extend(result["flowables"])
+                self.footnotes.update(result["footnotes"])
+                self.referenced.update(result["referenced"])
+                self.any_indexed = self.any_indexed or result["any_indexed"]
+
 
 class ItemWriter(Writer):
     "PDF item (section or text) writer."
@@ -1125,3 +1178,42 @@ class ItemWriter(Writer):
         except LayoutError as error:
             raise Error(str(error))
         return output.getvalue()
+
+
+def write_chapter(id, path, paragraph_number):
+    """Write the chapter given by its path in the book.
+    Return the flowables and the data required to complete the book.
+    Executed in a worker process.
+    """
+    book = books.get_book(id)
+    writer = BookWriter(book)
+    writer.paragraph_number = paragraph_number
+    writer.write_chapter(book[path])
+    return dict(
+        flowables=writer.flowables,
+        footnotes=writer.footnotes,
+        referenced=writer.referenced,
+        any_indexed=writer.any_indexed,
+    )
+
+
+def count_paragraphs(item):
+    "Return the number of numbered paragraphs in the item and its subitems."
+    if item.status == constants.OMITTED:
+        return 0
+    result = count_ast_paragraphs(item.ast)
+    if item.is_section:
+        for subitem in item.items:
+            result += count_paragraphs(subitem)
+    return result
+
+
+def count_ast_paragraphs(ast):
+    "Return the number of paragraphs in the AST, excluding footnote definitions."
+    if ast["element"] == "footnote_def":
+        return 0
+    result = 1 if ast["element"] == "paragraph" else 0
+    if isinstance(ast.get("children"), list):
+        for child in ast["children"]:
+            result += count_ast_paragraphs(child)
+    return result
@@ -1,9 +1,7 @@
 "References list, view and edit pages."
 
-import io
 import re
 import string
-import tarfile
 
 import bibtexparser
 from fasthtml.common import *
@@ -418,10 +416,8 @@ def post(request, ref: Text, content: str):
         lines.append(content)
     ref.write(content="\n".join(lines))
 
-    # Write out and reread the book, ensuring everything is up to date.
-    refs = get_refs()
-    refs.write()
-    refs.read()
+    # Write out the references book, since the digest of the item has changed.
+    get_refs().write()
 
     return components.redirect(f"/refs/view/{ref['id']}")
 
@@ -720,8 +716,8 @@ def get(request):
 
     filename = f"writethatbook_refs_{utils.str_datetime_safe()}.tgz"
 
-    return Response(
-        content=get_refs().get_tgz_content(),
+    return StreamingResponse(
+        utils.stream_tgz(get_refs().get_tgz_entries()),
         media_type=constants.GZIP_MIMETYPE,
         headers={"Content-Disposition": f'attachment; filename="{filename}"'},
     )
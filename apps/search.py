@@ -1,4 +1,8 @@
-"Search text in book or section."
+"Search text in all books, or in a book."
+
+import itertools
+import re
+import urllib.parse
 
 from fasthtml.common import *
 
@@ -6,6 +10,7 @@ import auth
 import books
 from books import Book
 import components
+import constants
 import utils
 from utils import Tx
 
@@ -13,6 +18,115 @@ from utils import Tx
 app, rt = components.get_fast_app()
 
 
+@rt("/")
+def get(request, term: str = None, page: int = 1):
+    "Search all books readable by the current user for a given term."
+    auth.allow_anyone(request)
+
+    if term:
+        hits = search_books(request, term)
+        page = max(1, page)
+        start = (page - 1) * constants.SEARCH_PAGE_SIZE
+        end = start + constants.SEARCH_PAGE_SIZE
+        items = []
+        for score, book, item, rx in hits[start:end]:
+            if item is book:
+                href = f"/book/{book}"
+                heading = book.title
+            else:
+                href = f"/book/{book}/{item.path}"
+                heading = f"{book.title} / {item.fulltitle}"
+            items.append(Li(A(heading, href=href), Br(), get_snippet(item, rx)))
+        if items:
+            result = [P(f"{start + 1}-{start + len(items)} ({len(hits)})"), Ul(*items)]
+            pages = []
+            if page > 1:
+                query = urllib.parse.urlencode(dict(term=term, page=page - 1))
+                pages.append(A(Tx("Previous"), href=f"/search?{query}"))
+            if end < len(hits):
+                query = urllib.parse.urlencode(dict(term=term, page=page + 1))
+                pages.append(A(Tx("Next"), href=f"/search?{query}"))
+            if pages:
+                result.append(P(*pages, cls="grid"))
+        else:
+            result = [P(f'{Tx("No result")}.')]
+    else:
+        result = []
+
+    title = Tx("Search all books")
+    return (
+        Title(title),
+        components.header(request, title),
+        Main(
+            Form(
+                Input(
+                    name="term",
+                    type="search",
+                    placeholder=title,
+                    value=term,
+                    autofocus=True,
+                ),
+                Input(type="submit", value=Tx("Search")),
+                role="search",
+                action="/search",
+                method="get",
+            ),
+            *result,
+            cls="container",
+        ),
+        components.footer(request),
+    )
+
+
+def search_books(request, term):
+    """Search all books readable by the current user for the term.
+    Return a list of tuples (score, book, item, compiled regexp),
+    highest score first.
+    """
+    # Ignore case only when term is in all lower-case.
+    ignorecase = term == term.casefold()
+    pattern = utils.wildcard_to_regexp(term)
+    try:
+        rx = re.compile(pattern, ignorecase and re.IGNORECASE or 0)
+    except re.error:
+        return []
+    result = []
+    for book in books.get_books(request):
+        for item in book.search(pattern, ignorecase=ignorecase):
+            result.append((get_score(item, rx), book, item, rx))
+    result.sort(key=lambda r: (-r[0], r[1].title, r[2].ordinal))
+    return result
+
+
+def get_score(item, rx):
+    """Return the relevance score of the item for the compiled regexp.
+    The number of matches in the content, and a bonus for a match in the title.
+    """
+    score = len(
+        list(itertools.islice(rx.finditer(item.content), constants.SEARCH_MAX_SCORE))
+    )
+    if rx.search(item.title or ""):
+        score += constants.SEARCH_MAX_SCORE
+    return score
+
+
+def get_snippet(item, rx):
+    "Return the piece of content around the first match, with the match marked."
+    content = item.content
+    match = rx.search(content)
+    if not match:  # Match in frontmatter only.
+        return ""
+    start = max(0, match.start() - constants.SEARCH_SNIPPET_CONTEXT)
+    end = min(len(content), match.end() + constants.SEARCH_SNIPPET_CONTEXT)
+    return Small(
+        start > 0 and "..." or "",
+        content[start : match.start()],
+        Mark(match.group()),
+        content[match.end() : end],
+        end < len(content) and "..." or "",
+    )
+
+
 @rt("/{book:Book}")
 def get(request, book: Book):
     "Form for searching the book for a given term."
@@ -2,6 +2,8 @@
 
 import datetime
 
+from fasthtml.common import JSONResponse
+
 import auth
 from books import Book, get_books, get_refs, get_imgs
 import components
@@ -38,34 +40,51 @@ def get_general_state():
 def get(request):
     "Return JSON for the overall state of this site."
     auth.allow_admin(request)
+    books = get_books(request) + [get_refs(), get_imgs()]
+    etag = components.get_etag(request, *[b.digest for b in books])
+    response = components.not_modified(request, etag)
+    if response is not None:
+        return response
     result = get_general_state()
     result["type"] = "site"
     result["books"] = get_books_state(request)
-    return result
+    return JSONResponse(result, headers=components.cache_headers(etag))
 
 
 @rt(f"/{constants.REFS}")
 def get(request):
     refs = get_refs()
     auth.authorize(request, *auth.book_view, book=refs)
+    etag = components.get_etag(request, refs.digest)
+    response = components.not_modified(request, etag)
+    if response is not None:
+        return response
     result = get_general_state()
     result.update(refs.state)
-    return result
+    return JSONResponse(result, headers=components.cache_headers(etag, refs.modified))
 
 
 @rt(f"/{constants.IMGS}")
 def get(request):
     imgs = get_imgs()
     auth.authorize(request, *auth.book_view, book=imgs)
+    etag = components.get_etag(request, imgs.digest)
+    response = components.not_modified(request, etag)
+    if response is not None:
+        return response
     result = get_general_state()
     result.update(imgs.state)
-    return result
+    return JSONResponse(result, headers=components.cache_headers(etag, imgs.modified))
 
 
 @rt("/{book:Book}")
 def get(request, book: Book):
     "Return JSON for the state of the book."
     auth.authorize(request, *auth.book_view, book=book)
+    etag = components.get_etag(request, book.digest)
+    response = components.not_modified(request, etag)
+    if response is not None:
+        return response
     result = get_general_state()
     result.update(book.state)
-    return result
+    return JSONResponse(result, headers=components.cache_headers(etag, book.modified))
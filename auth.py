@@ -14,15 +14,27 @@ def authorized(request, *rules, **context):
     Return True if the rule applies and allows access.
     Return False if the rule applies and denies access.
     Return False if no rule applies.
+    The result is memoized for the rules and context during the request.
     """
+    key = (rules, tuple((name, id(value)) for name, value in context.items()))
+    memo = request.scope.setdefault("authorized", {})
+    try:
+        return memo[key][0]
+    except KeyError:
+        pass
+    values = tuple(context.values())
     context["environ"] = os.environ
     context["current_user"] = request.scope.get("current_user")
     context["constants"] = constants
     for rule in rules:
         result = rule.apply(**context)
         if result is not None:
-            return result
-    return False
+            break
+    else:
+        result = False
+    # Keep the context objects, so that their ids are not reused during the request.
+    memo[key] = (result, values)
+    return result
 
 
 def authorize(request, *rules, **context):
@@ -42,27 +54,12 @@ def allow_anyone(request):
 
 def allow_logged_in(request):
     "Do not allow anonymous users."
-    authorize(request, Allow({"bool": {"var": "current_user"}}))
+    authorize(request, *any_user)
 
 
 def allow_admin(request):
     "Does the current user have role 'admin'?"
-    authorize(
-        request,
-        Allow(
-            {
-                "and": [
-                    {"bool": {"var": "current_user"}},
-                    {
-                        "==": [
-                            {"var": "current_user.role"},
-                            {"var": "constants.ADMIN_ROLE"},
-                        ]
-                    },
-                ]
-            }
-        ),
-    )
+    authorize(request, *admin_user)
 
 
 def logged_in(request):
@@ -83,10 +80,11 @@ class Allow:
 
     def __init__(self, logic):
         self.logic = logic
+        self.evaluate = json_logic.compile_logic(logic)
 
     def apply(self, **context):
         "Return None if rule does not apply, True of allowed, False if denied."
-        if json_logic.evaluate(self.logic, context):
+        if self.evaluate(context):
             return True
         return None
 
@@ -96,15 +94,38 @@ class Deny:
 
     def __init__(self, logic):
         self.logic = logic
+        self.evaluate = json_logic.compile_logic(logic)
 
     def apply(self, **context):
         "Return None if rule does not apply, True of allowed, False if denied."
-        if json_logic.evaluate(self.logic, context):
+        if self.evaluate(context):
             return False
         return None
 
 
 # Access rule sets.
+any_user = [
+    Allow({"bool": {"var": "current_user"}}),
+]
+
+
+admin_user = [
+    Allow(
+        {
+            "and": [
+                {"bool": {"var": "current_user"}},
+                {
+                    "==": [
+                        {"var": "current_user.role"},
+                        {"var": "constants.ADMIN_ROLE"},
+                    ]
+                },
+            ]
+        }
+    ),
+]
+
+
 user_view = [
     Deny({"not": {"var": "current_user"}}),
     Allow({"==": [{"var": "current_user"}, {"var": "user"}]}),
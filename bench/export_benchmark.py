@@ -0,0 +1,385 @@
+"""Benchmark the creation of PDF and DOCX files for a synthetic book.
+
+A book of the given size, with footnotes, indexed terms, references and
+SVG, PNG and Vega-Lite images, is generated in a temporary data directory.
+The book writers are timed with a breakdown into phases, and the peak
+memory use is recorded in a separate run. No network access is required.
+
+The first run of each format starts from empty caches; the remaining runs
+reuse whatever the caches (parsed Markdown, converted images, DOCX chapter
+fragments) retain from the previous runs.
+"""
+
+import argparse
+import functools
+import io
+import json
+import os
+from pathlib import Path
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Allow finding writethatbook modules.
+sys.path.insert(0, str(Path(sys.path[0]).parent))
+
+# The data directory must be set before importing the writethatbook modules.
+DIRPATH = Path(tempfile.mkdtemp(prefix="writethatbook_benchmark_"))
+os.environ["WRITETHATBOOK_DIR"] = str(DIRPATH)
+
+import docx.document
+import PIL.Image
+import reportlab.platypus.doctemplate
+import svglib.svglib
+import yaml
+
+import apps.docx
+import apps.pdf
+import books
+import constants
+import images
+import markdown
+import utils
+
+BOOK_ID = "benchmark"
+
+WORDS = (
+    "the of and to in that is was he for it with as his on be at by had not are "
+    "but from or have an they which one you were her all she there would their "
+    "we him been has when who will more no if out so said what up its about into "
+    "than them can only other new some could time these two may then do first any "
+    "my now such like our over man me even most made after also did many before "
+    "must through back years where much your way well down should because each"
+).split()
+
+SVG = """<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}">
+<rect x="10" y="10" width="{w}" height="{h}" fill="{color}" stroke="black"/>
+<circle cx="{cx}" cy="{cy}" r="{r}" fill="white"/>
+<text x="20" y="30" font-size="14">Figure {number}</text>
+</svg>"""
+
+VEGALITE = {
+    "$schema": "https://vega.github.io/schema/vega-lite/v5.json",
+    "description": "Synthetic bar chart.",
+    "mark": "bar",
+    "encoding": {
+        "x": {"field": "label", "type": "nominal"},
+        "y": {"field": "value", "type": "quantitative"},
+    },
+}
+
+
+def get_sentence(rnd, words=12):
+    "Return a random sentence."
+    sentence = " ".join(rnd.choice(WORDS) for i in range(words))
+    return sentence.capitalize() + "."
+
+
+def get_paragraph(rnd, sentences=5):
+    "Return a random paragraph."
+    return " ".join(get_sentence(rnd, rnd.randint(6, 18)) for i in range(sentences))
+
+
+def create_refs(rnd, number):
+    "Create the references in the references library. Return their ids."
+    refs = books.get_refs()
+    result = []
+    for count in range(number):
+        name = f"Author{count} {2000 + count % 25}"
+        ref = refs.create_text(name)
+        ref.set("type", rnd.choice([constants.ARTICLE, constants.BOOK]))
+        ref.set("id", utils.nameify(name))
+        ref.set("name", name)
+        ref.set("authors", [f"Author{count}, A.", f"Writer{count}, B."])
+        ref.set("title", get_sentence(rnd, 8))
+        ref.set("year", str(2000 + count % 25))
+        ref.set("journal", "Journal of Benchmarks")
+        ref.set("volume", str(count % 50 + 1))
+        ref.set("pages", f"{count}--{count + 10}")
+        ref.set("publisher", "Benchmark Press")
+        ref.write(content="")
+        result.append(ref["id"])
+    return result
+
+
+def create_imgs(rnd, number):
+    """Create the given number of SVG, PNG and Vega-Lite images
+    in the images library. Return their ids.
+    """
+    imgs = books.get_imgs()
+    result = []
+    for count in range(number):
+        for kind in ("svg", "png", "vegalite"):
+            imgid = f"{kind}{count}"
+            img = imgs.create_text(imgid)
+            img["id"] = imgid
+            img.title = f"Image {imgid}"
+            img["pdf"] = dict(scale_factor=constants.PDF_DEFAULT_IMAGE_SCALE_FACTOR)
+            img["docx"] = dict(scale_factor=constants.DOCX_DEFAULT_IMAGE_SCALE_FACTOR)
+            if kind == "png":
+                img["content_type"] = constants.PNG_MIMETYPE
+                image = PIL.Image.effect_noise((400, 300), 64 + count).convert("RGB")
+                data = io.BytesIO()
+                image.save(data, "PNG")
+                images.set_data(img, data.getvalue())
+            else:
+                if kind == "svg":
+                    img["content_type"] = constants.SVG_MIMETYPE
+                    img["data"] = SVG.format(
+                        width=400,
+                        height=300,
+                        w=380,
+                        h=280,
+                        color=rnd.choice(["red", "green", "blue"]),
+                        cx=rnd.randint(50, 350),
+                        cy=rnd.randint(50, 250),
+                        r=rnd.randint(10, 40),
+                        number=count,
+                    )
+                else:
+                    img["content_type"] = constants.JSON_MIMETYPE
+                    spec = dict(VEGALITE)
+                    spec["data"] = {
+                        "values": [
+                            dict(label=label, value=rnd.randint(1, 100))
+                            for label in "ABCDEFGH"
+                        ]
+                    }
+                    img["data"] = json.dumps(spec)
+                img["base64"] = False
+                img["pdf"]["reportlab_graphics"] = True
+                img["pdf"][
+                    "png_rendering_factor"
+                ] = constants.PDF_DEFAULT_PNG_RENDERING_FACTOR
+                img["docx"][
+                    "png_rendering_factor"
+                ] = constants.DOCX_DEFAULT_PNG_RENDERING_FACTOR
+            img.write(content=get_sentence(rnd, 8))
+            result.append(imgid)
+    return result
+
+
+def get_text_content(rnd, args, refids, imgids, terms):
+    "Return the Markdown content for a text."
+    paragraphs = []
+    for count in range(args.paragraphs):
+        paragraphs.append(get_paragraph(rnd))
+    # Insert the markup at random positions within the paragraphs.
+    for count in range(args.indexed):
+        number = rnd.randrange(len(paragraphs))
+        paragraphs[number] += f" The [#{rnd.choice(terms)}] here."
+    for count in range(args.cited):
+        if refids:
+            number = rnd.randrange(len(paragraphs))
+            paragraphs[number] += f" As shown [@{rnd.choice(refids)}]."
+    footnotes = []
+    for count in range(args.footnotes):
+        number = rnd.randrange(len(paragraphs))
+        paragraphs[number] += f" Noted.[^{count + 1}]"
+        footnotes.append(f"[^{count + 1}]: {get_sentence(rnd)}")
+    for count in range(args.figures):
+        if imgids:
+            number = rnd.randrange(len(paragraphs))
+            paragraphs[number] += f"\n\n![{get_sentence(rnd, 6)}]({rnd.choice(imgids)})"
+    return "\n\n".join(paragraphs + footnotes) + "\n"
+
+
+def create_book(args):
+    "Create the synthetic book with its references and images. Return the book."
+    rnd = random.Random(args.seed)
+    refids = create_refs(rnd, args.references)
+    imgids = create_imgs(rnd, args.images)
+    terms = [f"{rnd.choice(WORDS)} {rnd.choice(WORDS)}" for i in range(args.terms)]
+
+    dirpath = DIRPATH / BOOK_ID
+    dirpath.mkdir()
+    with open(dirpath / "index.md", "w") as outfile:
+        outfile.write("---\n")
+        outfile.write(yaml.dump({"title": "Benchmark book"}))
+        outfile.write(yaml.dump({"owner": constants.SYSTEM_USERID}))
+        outfile.write("---\n")
+        outfile.write(get_paragraph(rnd) + "\n")
+    book = books.get_book(BOOK_ID, reread=True)
+    for chapter in range(args.chapters):
+        section = book.create_section(f"Chapter {chapter + 1}")
+        section.write(content=get_paragraph(rnd) + "\n")
+        for number in range(args.texts):
+            text = book.create_text(f"Text {chapter + 1}.{number + 1}", parent=section)
+            text.write(content=get_text_content(rnd, args, refids, imgids, terms))
+    return book
+
+
+class Phases:
+    """Time spent in each phase of the book writing.
+    The time of a phase excludes the time of any other phase called within it.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.times = {}
+        self.calls = {}
+        self.stack = []
+
+    def wrap(self, owner, name, phase):
+        "Replace the function or method of the owner by one recording the phase."
+        function = getattr(owner, name)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            self.stack.append([phase, time.perf_counter(), 0.0])
+            try:
+                return function(*args, **kwargs)
+            finally:
+                phase_, start, nested = self.stack.pop()
+                elapsed = time.perf_counter() - start
+                self.times[phase] = self.times.get(phase, 0.0) + elapsed - nested
+                self.calls[phase] = self.calls.get(phase, 0) + 1
+                if self.stack:
+                    self.stack[-1][2] += elapsed
+
+        setattr(owner, name, wrapper)
+
+
+def instrument(phases):
+    "Record the phases of interest in the book writing."
+    phases.wrap(markdown, "to_ast", "ast")
+    for name in ("get_svg_root", "get_png", "get_data"):
+        phases.wrap(images, name, "images")
+    phases.wrap(svglib.svglib, "svg2rlg", "images")
+    phases.wrap(apps.pdf.BookWriter, "write_chapter", "chapters")
+    phases.wrap(reportlab.platypus.doctemplate.BaseDocTemplate, "build", "layout")
+    phases.wrap(apps.docx.BookWriter, "get_chapter_fragment", "chapters")
+    phases.wrap(apps.docx.BookWriter, "add_fragment", "assemble")
+    phases.wrap(docx.document.Document, "save", "save")
+
+
+def clear_caches():
+    "Clear the caches of parsed Markdown, converted images and DOCX fragments."
+    markdown._ast_cache.clear()
+    for dirname in (constants.IMAGES_CACHE_DIRNAME, constants.DOCX_CACHE_DIRNAME):
+        shutil.rmtree(DIRPATH / constants.CACHE / dirname, ignore_errors=True)
+
+
+def write(kind, book):
+    "Create the PDF or DOCX file for the book. Return its size in bytes."
+    if kind == "pdf":
+        writer = apps.pdf.BookWriter(book)
+    else:
+        writer = apps.docx.BookWriter(book)
+    return len(writer.get_content())
+
+
+def run(kind, book, phases, cold, memory=False):
+    "Run the book writer once. Return the measurements."
+    if cold:
+        clear_caches()
+    phases.reset()
+    if memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    size = write(kind, book)
+    total = time.perf_counter() - start
+    result = dict(kind=kind, cold=cold, size=size, total=total)
+    if memory:
+        result["peak_memory"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    else:
+        result["phases"] = dict(phases.times)
+        result["phases"]["other"] = total - sum(phases.times.values())
+        result["layout_passes"] = phases.calls.get("layout", 0)
+    return result
+
+
+def display(result):
+    "Print the measurements of a run."
+    label = f"{result['kind']} {'cold' if result['cold'] else 'warm'}"
+    if "peak_memory" in result:
+        print(f"{label:10} peak memory {result['peak_memory'] / 1024 / 1024:.1f} MB")
+        return
+    phases = ", ".join(f"{k} {v:.3f}" for k, v in result["phases"].items())
+    passes = ""
+    if result["layout_passes"]:
+        passes = f" layout passes {result['layout_passes']};"
+    print(
+        f"{label:10} total {result['total']:.3f} s ({phases});"
+        f"{passes} {result['size']} bytes"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--chapters", type=int, default=10, help="sections in book")
+    parser.add_argument("--texts", type=int, default=5, help="texts per chapter")
+    parser.add_argument("--paragraphs", type=int, default=10, help="per text")
+    parser.add_argument("--footnotes", type=int, default=3, help="per text")
+    parser.add_argument("--indexed", type=int, default=5, help="terms per text")
+    parser.add_argument("--terms", type=int, default=50, help="distinct terms")
+    parser.add_argument("--cited", type=int, default=3, help="citations per text")
+    parser.add_argument("--references", type=int, default=50, help="in library")
+    parser.add_argument("--figures", type=int, default=1, help="images per text")
+    parser.add_argument("--images", type=int, default=3, help="in library, per kind")
+    parser.add_argument("--formats", default="pdf,docx", help="comma-separated")
+    parser.add_argument("--runs", type=int, default=2, help="timed runs per format")
+    parser.add_argument("--toc-level", type=int, default=2)
+    parser.add_argument(
+        "--footnotes-location",
+        default=constants.FOOTNOTES_EACH_TEXT,
+        choices=constants.FOOTNOTES_LOCATIONS,
+    )
+    parser.add_argument("--chunk-numbers", action="store_true")
+    parser.add_argument(
+        "--pdf-workers",
+        type=int,
+        default=constants.PDF_CHAPTER_WORKERS,
+        help="processes writing PDF chapters; chapter phases are recorded only for 1",
+    )
+    parser.add_argument("--no-memory", action="store_true", help="skip memory run")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write the measurements to this file")
+    args = parser.parse_args()
+
+    try:
+        books.read_books()
+        start = time.perf_counter()
+        book = create_book(args)
+        print(
+            f"Created book: {len(list(book))} items, {book.sum_words} words"
+            f" in {time.perf_counter() - start:.3f} s"
+        )
+        settings = dict(
+            toc_level=args.toc_level,
+            footnotes_location=args.footnotes_location,
+            include_status=repr(constants.CREATED),
+        )
+        book.frontmatter["pdf"] = settings
+        book.frontmatter["docx"] = settings
+        if args.chunk_numbers:
+            book.chunk_numbers = True
+        constants.PDF_CHAPTER_WORKERS = args.pdf_workers
+
+        phases = Phases()
+        instrument(phases)
+        results = []
+        for kind in args.formats.split(","):
+            for count in range(args.runs):
+                results.append(run(kind, book, phases, cold=count == 0))
+                display(results[-1])
+            if not args.no_memory:
+                results.append(run(kind, book, phases, cold=True, memory=True))
+                display(results[-1])
+        if args.json:
+            with open(args.json, "w") as outfile:
+                json.dump(
+                    dict(arguments=vars(args), results=results), outfile, indent=2
+                )
+    finally:
+        shutil.rmtree(DIRPATH, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
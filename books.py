@@ -7,15 +7,19 @@ import io
 import json
 import os
 from pathlib import Path
+import pickle
 import re
 import shutil
 import tarfile
+import threading
 
 import yaml
 
 import auth
 import constants
 from errors import *
+import images
+import manifest
 import markdown
 import users
 import utils
@@ -34,15 +38,32 @@ _refs = None
 # Images book in-memory.
 _imgs = None
 
+# Books readable by a user, most recently modified first.
+# Key: (userid, is_admin), or None for anonymous; value: list of books.
+# Cleared when any book is changed, added or removed.
+_visible = {}
+# Incremented when the above is cleared, so that a list computed
+# concurrently with a change is not stored.
+_visible_generation = 0
+_visible_lock = threading.Lock()
+
+# Parsed Markdown files from the previous run, used only while reading all books.
+# Key: absolute file path; value: dict(stat, frontmatter, content, terms).
+_load_cache = {}
+
 
 def read_books():
     """Read in all books into memory.
     Exclude directories beginning with underscore "_",
     except '_refs' and '_imgs', which are read separately.
+    Files not changed since the previous run are restored from the load cache.
     """
+    global _load_cache
+    _load_cache = read_load_cache()
 
     global _books
     _books.clear()
+    clear_visible()
     for bookpath in Path(os.environ["WRITETHATBOOK_DIR"]).iterdir():
         if not bookpath.is_dir():
             continue
@@ -66,6 +87,7 @@ def read_books():
             outfile.write("---\n")
     _refs = Book(refspath)
     _refs.items.sort(key=lambda r: r["id"])
+    _refs.items_changed()
 
     global _imgs
     imgspath = Path(os.environ["WRITETHATBOOK_DIR"]) / constants.IMGS
@@ -78,23 +100,108 @@ def read_books():
             outfile.write(yaml.dump({"owner": constants.SYSTEM_USERID}))
             outfile.write("---\n")
     _imgs = Book(imgspath)
+    images.migrate(_imgs)
     _imgs.items.sort(key=lambda r: r["id"])
+    _imgs.items_changed()
+
+    write_load_cache()
+    _load_cache = {}
+    manifest.reconcile()
+
+
+def get_load_cache_filepath():
+    return (
+        Path(os.environ["WRITETHATBOOK_DIR"])
+        / constants.CACHE
+        / constants.LOAD_CACHE_FILENAME
+    )
+
+
+def read_load_cache():
+    "Return the load cache from file, or an empty one if missing or outdated."
+    try:
+        with open(get_load_cache_filepath(), "rb") as infile:
+            data = pickle.load(infile)
+    except (OSError, EOFError, pickle.PickleError):
+        return {}
+    if data.get("version") != constants.__version__:
+        return {}
+    return data["files"]
+
+
+def write_load_cache():
+    "Write the load cache for all files of the books currently in memory."
+    files = {}
+    for book in list(_books.values()) + [_refs, _imgs]:
+        for container in [book] + list(book):
+            if container.stat is None:
+                continue
+            files[str(container.absfilepath)] = dict(
+                stat=container.stat,
+                frontmatter=container.frontmatter,
+                content=container.content,
+                terms=container.terms,
+            )
+    filepath = get_load_cache_filepath()
+    filepath.parent.mkdir(exist_ok=True)
+    # Write to a temporary file first, to avoid a corrupt cache if interrupted.
+    tmppath = filepath.with_suffix(".tmp")
+    with open(tmppath, "wb") as outfile:
+        pickle.dump(dict(version=constants.__version__, files=files), outfile)
+    tmppath.replace(filepath)
+
+
+def find_terms(ast, terms):
+    "Collect the indexed terms, references and images in the AST of the content."
+    try:
+        for child in ast["children"]:
+            if isinstance(child, str):
+                continue
+            if child["element"] == "indexed":
+                terms["indexed"].add(child["canonical"])
+            elif child["element"] == "reference":
+                terms["refs"].add(child["id"])
+            elif child["element"] == "image":
+                terms["imgs"].add(child["dest"])
+            find_terms(child, terms)
+    except KeyError:
+        pass
 
 
 def get_books(request):
     """Get list of all books readable by the current user, excluding '_refs'.
     Also check that each book is owned by someone, else set it to current user.
+    The list is cached for the user until any book is changed, added or removed.
     """
+    user = request.scope.get("current_user")
+    key = user and (user.id, user.is_admin)
+    try:
+        return list(_visible[key])
+    except KeyError:
+        pass
+    generation = _visible_generation
     books = list(_books.values())
     for book in books:
         if book.owner is None:
-            book.owner = str(request.scope.get("current_user"))
+            book.owner = str(user)
             book.write()
-    return sorted(
+    result = sorted(
         [b for b in books if auth.authorized(request, *auth.book_view, book=b)],
-        key=lambda b: b.modified,
+        key=lambda b: b.summary["modified"],
         reverse=True,
     )
+    with _visible_lock:
+        if generation == _visible_generation:
+            _visible[key] = result
+    return list(result)
+
+
+def clear_visible():
+    "Clear the cached lists of books readable by users."
+    global _visible_generation
+    with _visible_lock:
+        _visible_generation += 1
+        _visible.clear()
 
 
 def get_book(id, reread=False):
@@ -112,27 +219,84 @@ def get_book(id, reread=False):
         try:
             book = Book(Path(os.environ["WRITETHATBOOK_DIR"]) / id)
             _books[book.id] = book
+            clear_visible()
             return book
         except FileNotFoundError:
             raise Error(f"no such book '{id}'", HTTP.NOT_FOUND)
 
 
+def load_book(id):
+    """Read the book from file, without writing anything, and keep it in memory.
+    Used in an export worker process, where the app has not read the books.
+    """
+    try:
+        book = Book(Path(os.environ["WRITETHATBOOK_DIR"]) / id, readonly=True)
+    except FileNotFoundError:
+        raise Error(f"no such book '{id}'", HTTP.NOT_FOUND)
+    _books[book.id] = book
+    return book
+
+
+def get_loaded_book(id):
+    "Get the book, or the refs or imgs book, if it is in memory, else None."
+    if id == constants.REFS:
+        return _refs
+    elif id == constants.IMGS:
+        return _imgs
+    else:
+        return _books.get(id)
+
+
+def reread_book(id):
+    """Reread the book, or the refs or imgs book. Add it if it is new,
+    or remove it if it no longer exists.
+    """
+    if id == constants.REFS:
+        get_refs(reread=True)
+    elif id == constants.IMGS:
+        get_imgs(reread=True)
+    elif (Path(os.environ["WRITETHATBOOK_DIR"]) / id / "index.md").exists():
+        get_book(id, reread=True)
+    else:
+        _books.pop(id, None)
+        clear_visible()
+
+
 def get_refs(reread=False):
-    "Get the references book, optionally rereading it."
+    """Get the references book, optionally rereading it.
+    Read it if not done, e.g. in an export worker process; nothing is written.
+    """
     global _refs
-    if reread:
+    if _refs is None:
+        _refs = Book(
+            Path(os.environ["WRITETHATBOOK_DIR"]) / constants.REFS, readonly=True
+        )
+        _refs.items.sort(key=lambda r: r["id"])
+        _refs.items_changed()
+    elif reread:
         _refs.read()
         _refs.items.sort(key=lambda r: r["id"])
+        _refs.items_changed()
         _refs.write()
     return _refs
 
 
 def get_imgs(reread=False):
-    "Get the images book, optionally rereading it."
+    """Get the images book, optionally rereading it.
+    Read it if not done, e.g. in an export worker process; nothing is written.
+    """
     global _imgs
-    if reread:
+    if _imgs is None:
+        _imgs = Book(
+            Path(os.environ["WRITETHATBOOK_DIR"]) / constants.IMGS, readonly=True
+        )
+        _imgs.items.sort(key=lambda r: r["id"])
+        _imgs.items_changed()
+    elif reread:
         _imgs.read()
+        images.migrate(_imgs)
         _imgs.items.sort(key=lambda r: r["id"])
+        _imgs.items_changed()
         _imgs.write()
     return _imgs
 
@@ -178,12 +342,15 @@ def unpack_tgz_content(dirpath, content, is_refs=False, is_imgs=False):
             for name in tf.getnames():
                 if name == "index.md":
                     continue
-                # No non-Markdown files allowed.
-                if not name.endswith(".md"):
-                    raise Error("refs TGZ file must contain only *.md files")
+                # No files other than Markdown and image data allowed.
+                if Path(name).suffix not in (
+                    constants.MARKDOWN_EXT,
+                    *constants.IMAGE_FILE_EXT.values(),
+                ):
+                    raise Error("imgs TGZ file must contain only *.md and image files")
                 # No subdirectories allowed.
                 if Path(name).name != name:
-                    raise Error("refs TGZ file must contain no directories")
+                    raise Error("imgs TGZ file must contain no directories")
             # Skip 'index.md' and anything that is not a file.
             filter = lambda f, path: f if f.name != "index.md" and f.isfile() else None
         # Ordinary book.
@@ -192,15 +359,38 @@ def unpack_tgz_content(dirpath, content, is_refs=False, is_imgs=False):
             filter = lambda f, path: f if f.isfile() or f.isdir() else None
 
         tf.extractall(path=dirpath, filter=filter)
+        manifest.update(dirpath)
     except tarfile.TarError as message:
         raise Error(f"tar file error: {message}")
 
 
+def get_trigrams(word):
+    "Return the set of three-character substrings of the word."
+    return set([word[i : i + 3] for i in range(len(word) - 2)])
+
+
 class Container:
     "General container of frontmatter and Markdown content. To be inherited."
 
     def read_file(self, filepath):
-        "Read frontmatter and content from the Markdown file."
+        """Read frontmatter and content from the Markdown file.
+        Use the load cache entry instead, if the file has not changed.
+        """
+        self._terms = None
+        self._tokens = None
+        self._n_words = None
+        self._digest = None
+        self._total_digest = None
+        self._sum_words = None
+        self._sum_characters = None
+        self._status = None
+        self.stat = utils.get_stat(filepath)
+        entry = _load_cache.get(str(filepath))
+        if entry and self.stat and entry["stat"] == self.stat:
+            self.frontmatter = copy.deepcopy(entry["frontmatter"])
+            self.content = entry["content"]
+            self._terms = entry["terms"]
+            return
         try:
             with open(filepath) as infile:
                 content = infile.read()
@@ -225,11 +415,56 @@ class Container:
     @subtitle.setter
     def subtitle(self, subtitle):
         self.frontmatter["subtitle"] = subtitle or None
+        self.changed()
 
     @property
     def ast(self):
         return markdown.to_ast(self.content)
 
+    @property
+    def n_words(self):
+        """Approximate number of words in the content of this container.
+        Cached until the container is changed.
+        """
+        if self._n_words is None:
+            self._n_words = len(self.content.split())
+        return self._n_words
+
+    @property
+    def searchable(self):
+        "Return the list of strings to search in this container."
+        return [self.content]
+
+    @property
+    def tokens(self):
+        """Return the set of words in the searchable strings, in lower case.
+        Cached until the container is changed.
+        """
+        if self._tokens is None:
+            self._tokens = set()
+            for value in self.searchable:
+                self._tokens.update(
+                    constants.SEARCH_TOKEN_PATTERN.findall(value.casefold())
+                )
+        return self._tokens
+
+    def matches(self, rx):
+        "Does the compiled regexp match any of the searchable strings?"
+        for value in self.searchable:
+            if rx.search(value):
+                return True
+        return False
+
+    @property
+    def terms(self):
+        """Return the indexed terms, references and images in the content.
+        Cached until the content is changed.
+        """
+        if self._terms is None:
+            self._terms = dict(indexed=set(), refs=set(), imgs=set())
+            find_terms(self.ast, self._terms)
+        return self._terms
+
     def write_file(self, filepath):
         "Write frontmatter and content to the Markdown file."
         with open(filepath, "w") as outfile:
@@ -239,6 +474,8 @@ class Container:
                 outfile.write("---\n")
             if self.content:
                 outfile.write(self.content)
+        self.stat = utils.get_stat(filepath)
+        manifest.update(filepath)
 
     def set_content(self, content):
         """Update content. Return True if any change, else False.
@@ -261,8 +498,44 @@ class Container:
         changed = content != self.content
         if changed:
             self.content = content
+            self._terms = None
+            self.changed()
         return changed
 
+    def changed(self):
+        """The frontmatter or content of this container has changed.
+        Reset the cached digest, and the cached values of the containers above.
+        """
+        self._digest = None
+        self._tokens = None
+        self._n_words = None
+        self.tree_changed()
+
+    def tree_changed(self):
+        """Something in the subtree of this container has changed.
+        Reset the cached values for this container and the containers above.
+        To be implemented by inheriting classes.
+        """
+        raise NotImplementedError
+
+    @property
+    def positions(self):
+        """Lookup of the zero-based position of each item in the list of items.
+        Cached until the list of items is changed.
+        """
+        if self._positions is None:
+            self._positions = dict((item, pos) for pos, item in enumerate(self.items))
+        return self._positions
+
+    def items_changed(self):
+        """The list of items in this container has changed.
+        Reset the cached positions, and the ordinals of all items below it.
+        """
+        self._positions = None
+        for item in self:
+            item._ordinal = None
+        self.tree_changed()
+
     def get_digest_instance(self):
         "Return the digest instance having processed item frontmatter and content."
         frontmatter = self.frontmatter.copy()
@@ -291,8 +564,13 @@ class Container:
 class Book(Container):
     "Root container for Markdown book texts in files and directories."
 
-    def __init__(self, abspath):
+    def __init__(self, abspath, readonly=False):
         self.abspath = abspath
+        # If read-only, do not write out 'index.md' when reading the book.
+        self.readonly = readonly
+        self._summary = None
+        # Guards the search index, which is updated and used by request threads.
+        self.search_lock = threading.Lock()
         self.read()
 
     def __str__(self):
@@ -325,6 +603,7 @@ class Book(Container):
         self.read_file(self.absfilepath)
 
         self.items = []
+        self._positions = None
 
         # Section and Text instances for directories and files that actually exist.
         for path in sorted(self.abspath.iterdir()):
@@ -363,21 +642,29 @@ class Book(Container):
         # Index key: indexed term; value: set of texts.
         # Refs key: reference identifier; value: set of texts.
         # Imgs key: reference identifier; value: set of texts.
+        # Terms lookup key: item; value: its keys currently in the above lookups.
+        # Updated when the book or an item is changed.
         self.indexed = {}
         self.refs = {}
         self.imgs = {}
-        ast = markdown.to_ast(self.content)
-        self.find_indexed(self, ast)
+        self.terms_lookup = {}
+        self.add_terms(self)
         for item in self:
-            ast = markdown.to_ast(item.content)
-            self.find_indexed(item, ast)
-            for keyword in item.get("keywords", []):
-                self.indexed.setdefault(keyword, set()).add(item)
-            self.find_refs(item, ast)
-            self.find_imgs(item, ast)
+            self.add_terms(item)
+
+        # Search index key: word in lower case; value: set of items.
+        # Search trigrams key: three characters; value: set of words containing it.
+        # Search tokens key: item; value: its words currently in the search index.
+        # Updated when searching for the items that have changed since then.
+        with self.search_lock:
+            self.search_index = {}
+            self.search_trigrams = {}
+            self.search_tokens = {}
+            self.search_stale = set([self] + list(self))
 
         # Write out "index.md" if order changed.
-        self.write()
+        if not self.readonly:
+            self.write()
 
     def write(self, content=None, force=False):
         """Write the 'index.md' file, if changed.
@@ -389,9 +676,12 @@ class Book(Container):
         self.frontmatter["type"] = self.type
         self.frontmatter["status"] = repr(self.status)
         self.frontmatter["sum_characters"] = self.sum_characters
+        # The frontmatter may have been modified directly; recompute the digest.
+        self.changed()
         self.frontmatter["digest"] = self.digest
         if changed or force or (self.frontmatter != original):
             self.write_file(self.absfilepath)
+        self.update_search_item(self)
 
     def set_items_order(self, container, items_order):
         "Chnage order of items in container according to given items_order."
@@ -408,6 +698,7 @@ class Book(Container):
                     self.set_items_order(item, ordered.get("items", []))
         # Append items not already referenced in the frontmatter 'items'.
         container.items.extend(original.values())
+        container.items_changed()
 
     def get_items_order(self, container):
         "Return current order of items in this book."
@@ -442,6 +733,7 @@ class Book(Container):
     @title.setter
     def title(self, title):
         self.frontmatter["title"] = title or None
+        self.changed()
 
     @property
     def fulltitle(self):
@@ -471,6 +763,7 @@ class Book(Container):
         if not users.get(userid=userid):
             raise ValueError(f"no such user '{userid}'")
         self.frontmatter["owner"] = userid
+        self.changed()
 
     @property
     def public(self):
@@ -479,6 +772,7 @@ class Book(Container):
     @public.setter
     def public(self, yes):
         self.frontmatter["public"] = bool(yes)
+        self.changed()
 
     @property
     def chunk_numbers(self):
@@ -487,6 +781,7 @@ class Book(Container):
     @chunk_numbers.setter
     def chunk_numbers(self, yes):
         self.frontmatter["chunk_numbers"] = bool(yes)
+        self.changed()
 
     @property
     def toc_synopsis(self):
@@ -495,19 +790,23 @@ class Book(Container):
     @toc_synopsis.setter
     def toc_synopsis(self, yes):
         self.frontmatter["toc_synopsis"] = bool(yes)
+        self.changed()
 
     @property
     def status(self):
-        "Return the lowest status for the sub-items, or from 'index.md' if no items."
-        if self.items:
-            status = constants.FINAL
-            for item in self.items:
-                status = min(status, item.status)
-        else:
-            status = constants.Status.lookup(
-                self.frontmatter.get("status"), constants.STARTED
-            )
-        return status
+        """Return the lowest status for the sub-items, or from 'index.md' if no items.
+        Cached until anything in the book is changed.
+        """
+        if self._status is None:
+            if self.items:
+                self._status = constants.FINAL
+                for item in self.items:
+                    self._status = min(self._status, item.status)
+            else:
+                self._status = constants.Status.lookup(
+                    self.frontmatter.get("status"), constants.STARTED
+                )
+        return self._status
 
     @status.setter
     def status(self, status):
@@ -521,6 +820,7 @@ class Book(Container):
         elif not isinstance(status, constants.Status):
             raise ValueError("Invalid instance for status.")
         self.frontmatter["status"] = repr(status)
+        self.changed()
 
     @property
     def authors(self):
@@ -531,6 +831,7 @@ class Book(Container):
         if not isinstance(authors, list):
             raise TypeError("authors must be a list")
         self.frontmatter["authors"] = authors
+        self.changed()
 
     @property
     def language(self):
@@ -539,6 +840,7 @@ class Book(Container):
     @language.setter
     def language(self, language):
         self.frontmatter["language"] = language or None
+        self.changed()
 
     @property
     def parent(self):
@@ -552,15 +854,14 @@ class Book(Container):
     def max_level(self):
         return max([i.level for i in self])
 
-    @property
-    def n_words(self):
-        "Approximate number of words in the 'index.md' of this book."
-        return len(self.content.split())
-
     @property
     def sum_words(self):
-        "Approximate number of words in the entire book."
-        return sum([i.sum_words for i in self.items]) + len(self.content.split())
+        """Approximate number of words in the entire book.
+        Cached until anything in the book is changed.
+        """
+        if self._sum_words is None:
+            self._sum_words = sum([i.sum_words for i in self.items]) + self.n_words
+        return self._sum_words
 
     @property
     def n_characters(self):
@@ -569,8 +870,14 @@ class Book(Container):
 
     @property
     def sum_characters(self):
-        "Approximate number of characters in the entire book."
-        return sum([i.sum_characters for i in self.items]) + len(self.content)
+        """Approximate number of characters in the entire book.
+        Cached until anything in the book is changed.
+        """
+        if self._sum_characters is None:
+            self._sum_characters = sum([i.sum_characters for i in self.items]) + len(
+                self.content
+            )
+        return self._sum_characters
 
     @property
     def docx(self):
@@ -597,52 +904,225 @@ class Book(Container):
     @property
     def digest(self):
         """Return the hex digest of the contents of the book.
-        Based on frontmatter (excluding digest!), content, and digests of items.
+        Based on frontmatter (excluding digest!), content, and digests of all items.
+        Cached until anything in the book is changed.
         """
-        digest = self.get_digest_instance()
-        for item in self.items:
-            utils.get_digest_instance(item.digest, digest=digest)
-        return digest.hexdigest()
+        if self._digest is None:
+            digest = self.get_digest_instance()
+            for item in self.items:
+                utils.get_digest_instance(item.total_digest, digest=digest)
+            self._digest = digest.hexdigest()
+        return self._digest
+
+    def changed(self):
+        "The frontmatter or content of the book has changed."
+        super().changed()
+        self.update_terms(self)
+        self.search_stale.add(self)
+
+    def tree_changed(self):
+        """Something in the book has changed. Reset the cached digest and summary,
+        and the cached lists of books readable by users.
+        """
+        self._digest = None
+        self._sum_words = None
+        self._sum_characters = None
+        self._status = None
+        self._summary = None
+        clear_visible()
+
+    @property
+    def summary(self):
+        """Return a dictionary of the values shown in the list of books.
+        Cached until anything in the book is changed.
+        """
+        if self._summary is None:
+            self._summary = dict(
+                title=self.title,
+                type=self.type,
+                status=self.status,
+                sum_words=self.sum_words,
+                sum_characters=self.sum_characters,
+                owner=self.owner,
+                public=self.public,
+                modified=self.modified,
+            )
+        return self._summary
 
     @property
     def ordinal(self):
         return (0,)
 
-    def find_indexed(self, item, ast):
-        "Return the indexed terms in the AST of the content."
-        try:
-            for child in ast["children"]:
-                if isinstance(child, str):
+    def add_terms(self, item):
+        """Add the indexed terms, keywords, references and images of the item.
+        For the book itself, only its indexed terms are added.
+        """
+        terms = dict(indexed=set(item.terms["indexed"]), refs=set(), imgs=set())
+        if item is not self:
+            terms["indexed"].update(item.get("keywords", []))
+            terms["refs"].update(item.terms["refs"])
+            terms["imgs"].update(item.terms["imgs"])
+        for term in terms["indexed"]:
+            self.indexed.setdefault(term, set()).add(item)
+        for refid in terms["refs"]:
+            self.refs.setdefault(refid, set()).add(item)
+        for dest in terms["imgs"]:
+            self.imgs.setdefault(dest, set()).add(item)
+        self.terms_lookup[item] = terms
+
+    def remove_terms(self, item):
+        """Remove the indexed terms, keywords, references and images of the item,
+        as they were when added.
+        """
+        terms = self.terms_lookup.pop(item, None)
+        if terms is None:
+            return
+        for lookup, keys in [
+            (self.indexed, terms["indexed"]),
+            (self.refs, terms["refs"]),
+            (self.imgs, terms["imgs"]),
+        ]:
+            for key in keys:
+                items = lookup.get(key)
+                if items is None:
                     continue
-                if child["element"] == "indexed":
-                    self.indexed.setdefault(child["canonical"], set()).add(item)
-                self.find_indexed(item, child)
-        except KeyError:
-            pass
+                items.discard(item)
+                if not items:
+                    lookup.pop(key)
+
+    def update_terms(self, item):
+        "Update the indexed terms, etc, of the item, which has been changed."
+        if item is self or self.path_lookup.get(item.path) is item:
+            self.remove_terms(item)
+            self.add_terms(item)
+
+    def add_lookups(self, item):
+        "Add the item and all its subitems to the path and term lookups."
+        for it in [item] + list(item):
+            self.path_lookup[it.path] = it
+            self.add_terms(it)
+            self.search_stale.add(it)
+
+    def remove_lookups(self, item):
+        "Remove the item and all its subitems from the path and term lookups."
+        for it in [item] + list(item):
+            self.path_lookup.pop(it.path, None)
+            self.remove_terms(it)
+            with self.search_lock:
+                self.remove_search_tokens(it)
+                self.search_stale.discard(it)
+
+    def update_search_index(self):
+        """Update the search index for the items that have changed since last time.
+        The search lock must be held by the caller.
+        """
+        while self.search_stale:
+            self.add_search_tokens(self.search_stale.pop())
 
-    def find_refs(self, item, ast):
-        "Return the references in the AST of the content."
-        try:
-            for child in ast["children"]:
-                if isinstance(child, str):
-                    continue
-                if child["element"] == "reference":
-                    self.refs.setdefault(child["id"], set()).add(item)
-                self.find_refs(item, child)
-        except KeyError:
-            pass
+    def update_search_item(self, item):
+        """Update the search index for the item, which has been written.
+        Done only if the search index has been built; else left until searched.
+        """
+        with self.search_lock:
+            if self.search_tokens and item in self.search_stale:
+                self.search_stale.discard(item)
+                self.add_search_tokens(item)
+
+    def add_search_tokens(self, item):
+        """Add the item to the search index, replacing its previous words, if any.
+        The search lock must be held by the caller.
+        """
+        self.remove_search_tokens(item)
+        tokens = item.tokens
+        for token in tokens:
+            try:
+                self.search_index[token].add(item)
+            except KeyError:
+                self.search_index[token] = set([item])
+                for trigram in get_trigrams(token):
+                    self.search_trigrams.setdefault(trigram, set()).add(token)
+        self.search_tokens[item] = tokens
+
+    def remove_search_tokens(self, item):
+        """Remove the item from the search index.
+        The search lock must be held by the caller.
+        """
+        for token in self.search_tokens.pop(item, []):
+            items = self.search_index[token]
+            items.discard(item)
+            if not items:
+                self.search_index.pop(token)
+                for trigram in get_trigrams(token):
+                    tokens = self.search_trigrams[trigram]
+                    tokens.discard(token)
+                    if not tokens:
+                        self.search_trigrams.pop(trigram)
+
+    def get_search_candidates(self, term):
+        """Return the set of items that may match the regexp term.
+        Return None if the search index cannot be used for the term.
+        Every word in the term must occur within a word in a candidate.
+        """
+        if not constants.SEARCH_INDEXABLE_PATTERN.fullmatch(term):
+            return None
+        words = constants.SEARCH_SPLIT_PATTERN.split(term.casefold())
+        words = [w for w in words if w]
+        if not words:
+            return None
+        with self.search_lock:
+            self.update_search_index()
+            result = None
+            for word in words:
+                items = set()
+                for token in self.get_search_tokens(word):
+                    items.update(self.search_index[token])
+                if result is None:
+                    result = items
+                else:
+                    result.intersection_update(items)
+                if not result:
+                    break
+        return result
 
-    def find_imgs(self, item, ast):
-        "Return the images in the AST of the content."
-        try:
-            for child in ast["children"]:
-                if isinstance(child, str):
-                    continue
-                if child["element"] == "image":
-                    self.imgs.setdefault(child["dest"], set()).add(item)
-                self.find_imgs(item, child)
-        except KeyError:
-            pass
+    def get_search_tokens(self, word):
+        """Return the words in the search index which contain the given word.
+        The search lock must be held by the caller.
+        """
+        trigrams = get_trigrams(word)
+        # Too short a word to use the trigrams; check all words in the index.
+        if not trigrams:
+            return [token for token in self.search_index if word in token]
+        tokens = [self.search_trigrams.get(trigram, set()) for trigram in trigrams]
+        tokens.sort(key=len)
+        return [token for token in tokens[0] if word in token]
+
+    def reload_path(self, abspath):
+        """Update the item for the file or directory, which has been changed
+        outside of this app. Return False if this cannot be done for the item
+        alone, i.e. the book must be reread, else True.
+        """
+        if abspath == self.absfilepath:
+            return self.stat == utils.get_stat(abspath)
+        relpath = abspath.relative_to(self.abspath)
+        if relpath.name == "index.md":
+            relpath = relpath.parent
+        elif relpath.suffix == constants.MARKDOWN_EXT:
+            relpath = relpath.with_suffix("")
+        elif not abspath.is_dir() and abspath.exists():
+            return True  # Ignore other files.
+        item = self.path_lookup.get(relpath.as_posix())
+        if abspath.is_dir():
+            return item is not None and item.is_section
+        if not abspath.exists():  # Unless already removed by this app.
+            return item is None
+        if item is None:  # New file, or an excluded text.
+            return False
+        stat = utils.get_stat(abspath)
+        if item.stat == stat:  # Written by this app.
+            return True
+        item.read_file(abspath)
+        item.changed()
+        return not item.get("exclude")
 
     def get(self, path, default=None):
         "Return the item given its path."
@@ -664,6 +1144,7 @@ class Book(Container):
         section = Section(self, parent, name)
         section.title = title
         parent.items.append(section)
+        parent.items_changed()
         self.path_lookup[section.path] = section
         section.write()
         self.write()
@@ -684,6 +1165,7 @@ class Book(Container):
         text = Text(self, parent, name)
         text.title = title
         parent.items.append(text)
+        parent.items_changed()
         self.path_lookup[text.path] = text
         text.write()
         self.write()
@@ -780,6 +1262,7 @@ class Book(Container):
             shutil.copytree(self.abspath, abspath)
         except shutil.Error as error:
             raise Error(error, HTTP.CONFLICT)
+        manifest.update(abspath)
         book = Book(abspath)
         if number:
             book.title = f'{self.title} ({Tx("copy*")} {number})'
@@ -799,34 +1282,37 @@ class Book(Container):
         if not force and len(self.items) != 0:
             raise ValueError("Cannot delete non-empty book.")
         _books.pop(self.id, None)
+        clear_visible()
         shutil.rmtree(self.abspath)
+        manifest.update(self.abspath)
         get_refs(reread=True)
         get_imgs(reread=True)
 
-    def get_tgz_content(self):
-        """Return the contents of the gzipped tar file containing
-        all files for the items of this book.
+    def get_tgz_entries(self):
+        """Return the list of tuples (path, arcname) for the gzipped tar file
+        containing all files for the items of this book.
         """
-        buffer = io.BytesIO()
-        with tarfile.open(fileobj=buffer, mode="w:gz") as tgzfile:
-            tgzfile.add(self.absfilepath, arcname="index.md")
-            for item in self.items:
-                tgzfile.add(item.abspath, arcname=item.filename(), recursive=True)
-        return buffer.getvalue()
+        result = [(self.absfilepath, "index.md")]
+        for item in self.items:
+            result.append((item.abspath, item.filename()))
+            # Images book: separate file for image data.
+            if item.get("file"):
+                result.append((self.abspath / item["file"], item["file"]))
+        return result
 
     def search(self, term, ignorecase=True):
-        "Find the set of items in the book that contain the term in the content."
+        """Find the set of items in the book that contain the term in the content.
+        Only the candidate items from the search index are checked, if possible.
+        """
         if ignorecase:
             flags = re.IGNORECASE
         else:
             flags = 0
         rx = re.compile(term, flags)
-        result = set()
-        if rx.search(self.content):
-            result.add(self)
-        for item in self.items:
-            result.update(item.search(rx))
-        return result
+        candidates = self.get_search_candidates(term)
+        if candidates is None:
+            candidates = [self] + list(self)
+        return set([item for item in candidates if item.matches(rx)])
 
     def check_integrity(self):
         assert self.absfilepath.exists()
@@ -847,6 +1333,7 @@ class Item(Container):
         self.book = book
         self.parent = parent
         self._name = name
+        self._ordinal = None
         self.read()
 
     def __str__(self):
@@ -860,6 +1347,7 @@ class Item(Container):
 
     def __setitem__(self, key, value):
         self.frontmatter[key] = value
+        self.changed()
 
     def __iter__(self):
         for item in self.items:
@@ -878,6 +1366,7 @@ class Item(Container):
             self.frontmatter[key] = value
         else:
             self.frontmatter.pop(key, None)
+        self.changed()
 
     def read(self):
         "To be implemented by inheriting classes. Recursive."
@@ -894,6 +1383,7 @@ class Item(Container):
     @synopsis.setter
     def synopsis(self, synopsis):
         self.frontmatter["synopsis"] = synopsis
+        self.changed()
 
     @property
     def name(self):
@@ -921,6 +1411,7 @@ class Item(Container):
         oldabspath = self.abspath
         self._name = name
         oldabspath.rename(newabspath)
+        manifest.update(oldabspath, newabspath)
         for item in items:
             self.book.path_lookup[item.path] = item
         self.book.write()
@@ -940,6 +1431,7 @@ class Item(Container):
     @title.setter
     def title(self, title):
         self.frontmatter["title"] = title
+        self.changed()
 
     @property
     def fulltitle(self):
@@ -968,27 +1460,58 @@ class Item(Container):
     @property
     def index(self):
         "The zero-based position of this item among its siblings."
-        for count, item in enumerate(self.parent.items):
-            if item is self:
-                return count
+        return self.parent.positions[self]
 
     @property
     def digest(self):
         """Return the hex digest of the contents of the item.
         Based on frontmatter (excluding 'digest!') and content of the item.
         Does not include any data from the subitems.
+        Cached until the item is changed.
+        """
+        if self._digest is None:
+            self._digest = self.get_digest_instance().hexdigest()
+        return self._digest
+
+    @property
+    def total_digest(self):
+        """Return the hex digest of the contents of the item and all its subitems.
+        Cached until the item or anything below it is changed.
         """
-        return self.get_digest_instance().hexdigest()
+        if self._total_digest is None:
+            digest = utils.get_digest_instance(self.digest)
+            for item in self.items:
+                utils.get_digest_instance(item.total_digest, digest=digest)
+            self._total_digest = digest.hexdigest()
+        return self._total_digest
+
+    def changed(self):
+        "The frontmatter or content of the item has changed."
+        super().changed()
+        self.book.update_terms(self)
+        self.book.search_stale.add(self)
+
+    def tree_changed(self):
+        """Something in the subtree of this item has changed.
+        Reset the cached values for this item and the containers above.
+        """
+        self._total_digest = None
+        self._sum_words = None
+        self._sum_characters = None
+        self._status = None
+        self.parent.tree_changed()
 
     @property
     def ordinal(self):
-        "Tuple of parent's and its own index for sorting purposes."
-        result = [self.index + 1]
-        parent = self.parent
-        while parent is not self.book:
-            result.append(parent.index + 1)
-            parent = parent.parent
-        return tuple(reversed(result))
+        """Tuple of parent's and its own index for sorting purposes.
+        Cached until the list of items above it is changed.
+        """
+        if self._ordinal is None:
+            if self.parent is self.book:
+                self._ordinal = (self.index + 1,)
+            else:
+                self._ordinal = self.parent.ordinal + (self.index + 1,)
+        return self._ordinal
 
     @property
     def heading(self):
@@ -1080,6 +1603,7 @@ class Item(Container):
             self.parent.items.insert(0, item)
         else:
             self.parent.items.insert(index + 1, item)
+        self.parent.items_changed()
         # Write out book 'index.md' containing new order.
         self.book.write()
 
@@ -1091,6 +1615,7 @@ class Item(Container):
             self.parent.items.append(item)
         else:
             self.parent.items.insert(index - 1, item)
+        self.parent.items_changed()
         # Write out book 'index.md' containing new order.
         self.book.write()
 
@@ -1117,24 +1642,24 @@ class Item(Container):
             self.book.path_lookup.pop(item.path)
         # Remove item from its parent's list of items.
         self.parent.items.remove(self)
+        self.parent.items_changed()
         # Actually move the item on disk.
         old_abspath.rename(new_abspath)
+        manifest.update(old_abspath, new_abspath)
         # Add item into the parent above, after the position of its old parent.
-        pos = self.parent.parent.items.index(self.parent) + 1
+        pos = self.parent.index + 1
         self.parent.parent.items.insert(pos, self)
         # Set the new parent for this item.
         self.parent = self.parent.parent
+        self.parent.items_changed()
         # Add back this item and its subitems to the path lookup of the book.
         self.book.path_lookup[self.path] = self
         for item in self:
             self.book.path_lookup[item.path] = item
         self.check_integrity()
-        # Write out book and reread everything.
-        # refs, imgs and indexes must be updated.
+        # The term lookups refer to the items themselves, not their paths,
+        # so they need not be changed. Write out book containing new order.
         self.book.write()
-        self.book.read()
-        get_refs(reread=True)
-        get_imgs(reread=True)
 
     def into(self):
         "Move this item into the section closest backward of it."
@@ -1160,23 +1685,23 @@ class Item(Container):
             self.book.path_lookup.pop(item.path)
         # Remove item from its parent's list of items.
         self.parent.items.remove(self)
+        self.parent.items_changed()
         # Actually move the item on disk.
         old_abspath.rename(new_abspath)
+        manifest.update(old_abspath, new_abspath)
         # Add item into the section, as the last one.
         section.items.append(self)
         # Set the new parent for this item.
         self.parent = section
+        self.parent.items_changed()
         # Add back this item and its subitems to the path lookup of the book.
         self.book.path_lookup[self.path] = self
         for item in self:
             self.book.path_lookup[item.path] = item
         self.check_integrity()
-        # Write out book and reread everything.
-        # refs, img and indexes must be updated.
+        # The term lookups refer to the items themselves, not their paths,
+        # so they need not be changed. Write out book containing new order.
         self.book.write()
-        self.book.read()
-        get_refs(reread=True)
-        get_imgs(reread=True)
 
     def copy(self):
         "Copy this item."
@@ -1202,6 +1727,7 @@ class Section(Item):
 
     def __init__(self, book, parent, name):
         self.items = []
+        self._positions = None
         super().__init__(book, parent, name)
 
     def read(self):
@@ -1243,26 +1769,28 @@ class Section(Item):
         """
         changed = self.set_content(content)
         original = copy.deepcopy(self.frontmatter)
+        # The frontmatter may have been modified directly; recompute the digest.
+        self.changed()
         self.frontmatter["digest"] = self.digest
         if changed or force or (self.frontmatter != original):
             self.write_file(self.absfilepath)
+        self.book.update_search_item(self)
 
     @property
     def type(self):
         return constants.SECTION
 
-    @property
-    def n_words(self):
-        "Approximate number of words in 'index.md' of this section."
-        return len(self.content.split())
-
     @property
     def sum_words(self):
-        "Approximate number of words in the entire section."
-        if self.status is constants.OMITTED:
-            return 0
-        else:
-            return sum([i.sum_words for i in self.items]) + len(self.content.split())
+        """Approximate number of words in the entire section.
+        Cached until anything in the section is changed.
+        """
+        if self._sum_words is None:
+            if self.status is constants.OMITTED:
+                self._sum_words = 0
+            else:
+                self._sum_words = sum([i.sum_words for i in self.items]) + self.n_words
+        return self._sum_words
 
     @property
     def n_characters(self):
@@ -1271,11 +1799,17 @@ class Section(Item):
 
     @property
     def sum_characters(self):
-        "Approximate number of characters in the entire section."
-        if self.status is constants.OMITTED:
-            return 0
-        else:
-            return sum([i.sum_characters for i in self.items]) + len(self.content)
+        """Approximate number of characters in the entire section.
+        Cached until anything in the section is changed.
+        """
+        if self._sum_characters is None:
+            if self.status is constants.OMITTED:
+                self._sum_characters = 0
+            else:
+                self._sum_characters = sum(
+                    [i.sum_characters for i in self.items]
+                ) + len(self.content)
+        return self._sum_characters
 
     @property
     def modified(self):
@@ -1285,14 +1819,17 @@ class Section(Item):
 
     @property
     def status(self):
-        "Return the lowest status for the sub-items."
-        if self.items:
-            status = constants.FINAL
-            for item in self.items:
-                status = min(status, item.status)
-        else:
-            status = constants.STATUSES[0]
-        return status
+        """Return the lowest status for the sub-items.
+        Cached until anything in the section is changed.
+        """
+        if self._status is None:
+            if self.items:
+                self._status = constants.FINAL
+                for item in self.items:
+                    self._status = min(self._status, item.status)
+            else:
+                self._status = constants.STATUSES[0]
+        return self._status
 
     @property
     def state(self):
@@ -1328,37 +1865,38 @@ class Section(Item):
             shutil.copytree(self.abspath, abspath)
         except shutil.Error as error:
             raise Error(error, HTTP.CONFLICT)
+        manifest.update(abspath)
         section = Section(self.book, self.parent, abspath.stem)
         if number:
             section.frontmatter["title"] = f'{self.title} ({Tx("copy*")} {number})'
         else:
             section.frontmatter["title"] = f'{self.title} ({Tx("copy*")})'
         self.parent.items.insert(self.index + 1, section)
+        self.parent.items_changed()
         section.write()
+        # Only the copied items need to be added to the lookups.
+        self.book.add_lookups(section)
         path = section.path
         self.book.write()
-        self.book.read()
-        get_refs(reread=True)
-        get_imgs(reread=True)
         return path
 
     def delete(self, force=False):
         "Delete this section from the book."
         if not force and len(self.items) != 0:
             raise ValueError("Cannot delete non-empty section.")
-        self.book.path_lookup.pop(self.path)
+        self.book.remove_lookups(self)
         self.parent.items.remove(self)
+        self.parent.items_changed()
         shutil.rmtree(self.abspath)
+        manifest.update(self.abspath)
         self.book.write()
         get_refs(reread=True)
         get_imgs(reread=True)
 
     def search(self, rx):
-        """Find the set of items that match the compiled regexp.
-        If this is a reference, then also search a set of frontmatter entries.
-        """
+        "Find the set of items that match the compiled regexp."
         result = set()
-        if rx.search(self.content):
+        if self.matches(rx):
             result.add(self)
         for item in self.items:
             result.update(item.search(rx))
@@ -1382,9 +1920,12 @@ class Text(Item):
         """
         changed = self.set_content(content)
         original = copy.deepcopy(self.frontmatter)
+        # The frontmatter may have been modified directly; recompute the digest.
+        self.changed()
         self.frontmatter["digest"] = self.digest
         if changed or force or (self.frontmatter != original):
             self.write_file(self.abspath)
+        self.book.update_search_item(self)
 
     @property
     def type(self):
@@ -1395,11 +1936,6 @@ class Text(Item):
         "All immediate subitems (none). Instead of an empty list attribute."
         return []
 
-    @property
-    def n_words(self):
-        "Approximate number of words in the text."
-        return len(self.content.split())
-
     @property
     def sum_words(self):
         "Approximate number of words in the text."
@@ -1442,6 +1978,7 @@ class Text(Item):
         elif not isinstance(status, constants.Status):
             raise ValueError("Invalid instance for status.")
         self.frontmatter["status"] = repr(status)
+        self.changed()
 
     @property
     def state(self):
@@ -1486,6 +2023,7 @@ class Text(Item):
             shutil.copy2(self.abspath, abspath)
         except shutil.Error as error:
             raise Error(error, HTTP.CONFLICT)
+        manifest.update(abspath)
 
         text = Text(self.book, self.parent, abspath.stem)
         if number:
@@ -1493,27 +2031,35 @@ class Text(Item):
         else:
             text.frontmatter["title"] = f'{self.title} ({Tx("copy*")})'
         self.parent.items.insert(self.index + 1, text)
+        self.parent.items_changed()
         text.write()
+        # Only the copied items need to be added to the lookups.
+        self.book.add_lookups(text)
         path = text.path
         self.book.write()
-        self.book.read()
-        get_refs(reread=True)
-        get_imgs(reread=True)
         return path
 
     def delete(self, force=False):
         "Delete this text from the book."
-        self.book.path_lookup.pop(self.path)
+        self.book.remove_lookups(self)
         self.parent.items.remove(self)
+        self.parent.items_changed()
         self.abspath.unlink()
+        manifest.update(self.abspath)
         self.book.write()
 
     def search(self, rx):
-        """Find the set of items that contain the term in the content."
-        Also search a set of frontmatter entries appropriate for a reference.
-        """
-        if rx.search(self.content):
+        "Find the set of items that match the compiled regexp."
+        if self.matches(rx):
             return set([self])
+        return set()
+
+    @property
+    def searchable(self):
+        """Return the list of strings to search in this text.
+        Includes a set of frontmatter entries appropriate for a reference.
+        """
+        result = [self.content]
         for key in [
             "name",
             "title",
@@ -1525,12 +2071,10 @@ class Text(Item):
             "pmid",
         ]:
             value = self.get(key)
-            if value and rx.search(value):
-                return set([self])
-        for author in self.get("authors", []):
-            if rx.search(author):
-                return set([self])
-        return set()
+            if value:
+                result.append(str(value))
+        result.extend(self.get("authors", []))
+        return result
 
     def check_integrity(self):
         super().check_integrity()
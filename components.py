@@ -1,5 +1,6 @@
 "FastHTML components and functions."
 
+import email.utils
 import os
 import string
 
@@ -14,7 +15,7 @@ import utils
 from utils import Tx
 
 
-def get_fast_app(routes=None):
+def get_fast_app(routes=None, on_startup=None):
     app, rt = fast_app(
         live="WRITETHATBOOK_DEVELOPMENT" in os.environ,
         static_path="static",
@@ -26,6 +27,7 @@ def get_fast_app(routes=None):
             InvalidApiKey: invalid_api_key_handler,
         },
         routes=routes,
+        on_startup=on_startup,
     )
     setup_toasts(app)
     return app, rt
@@ -36,6 +38,47 @@ def redirect(href):
     return RedirectResponse(href, status_code=HTTP.SEE_OTHER)
 
 
+def get_etag(request, *digests):
+    """Return the entity tag for a response showing data with the given digests.
+    Depends also on the current user, since the menus and tools shown
+    depend on it, and on the software version.
+    It is a weak tag; parts of the response such as timestamps may differ.
+    """
+    digest = utils.get_digest_instance(constants.__version__)
+    user = auth.logged_in(request)
+    if user:
+        utils.get_digest_instance(f"{user.id} {user.role} {user.name}", digest=digest)
+    for value in digests:
+        utils.get_digest_instance(value, digest=digest)
+    return f'W/"{digest.hexdigest()}"'
+
+
+def not_modified(request, etag):
+    """Return a 'not modified' response if the client already has the response
+    with the given entity tag, else None.
+    Never if there are toast messages waiting to be shown.
+    """
+    if "toasts" in request.session:
+        return None
+    tags = [t.strip() for t in request.headers.get("If-None-Match", "").split(",")]
+    if etag in tags:
+        return Response(status_code=HTTP.NOT_MODIFIED, headers=cache_headers(etag))
+    return None
+
+
+def cache_headers(etag, modified=None):
+    "Return the HTTP headers for conditional requests of the response."
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if modified:
+        headers["Last-Modified"] = email.utils.format_datetime(modified, usegmt=True)
+    return headers
+
+
+def http_headers(etag, modified=None):
+    "Return the HTTP headers for conditional requests to add to a page."
+    return [HttpHeader(k, v) for k, v in cache_headers(etag, modified).items()]
+
+
 def blank(width, style=None):
     if isinstance(width, (int, float)):
         width = str(width) + "em"
@@ -97,6 +140,7 @@ def header(request, title, book=None, item=None, tools=None, search=True):
         A(Tx("Books"), href="/"),
         A(Tx("References"), href="/refs"),
         A(Tx("Images"), href="/imgs"),
+        A(Tx("Search all books"), href="/search"),
     ]
 
     # Links to pages for book and item.
@@ -6,7 +6,7 @@ import re
 
 import babel.dates
 
-VERSION = (1, 22, 0)
+VERSION = (1, 23, 0)
 __version__ = ".".join([str(n) for n in VERSION])
 
 GITHUB_URL = "https://github.com/pekrau/writethatbook"
@@ -20,7 +20,9 @@ MARKDOWN_EXT = ".md"
 SOURCE_DIRPATH = Path(__file__).parent
 TRANSLATIONS_FILEPATH = SOURCE_DIRPATH / "translations.csv"
 
-USERS_DATABASE_FILENAME = "users.yaml"
+USERS_DATABASE_FILENAME = "users.db"
+USERS_DATABASE_TIMEOUT = 5000  # Milliseconds to wait for a locked database.
+USERS_YAML_FILENAME = "users.yaml"  # Used by previous versions.
 MIN_PASSWORD_LENGTH = 6
 
 SYSTEM_USERID = "system"
@@ -111,6 +113,11 @@ BOOK = "book"
 LINK = "link"
 
 MAX_RECENT = 20
+
+# Search in all books.
+SEARCH_PAGE_SIZE = 20
+SEARCH_SNIPPET_CONTEXT = 60
+SEARCH_MAX_SCORE = 100
 MAX_COPY_NUMBER = 20
 
 REFS = "_refs"
@@ -125,6 +132,45 @@ MAX_DISPLAY_AUTHORS = 4
 
 IMGS = "_imgs"
 
+# Directory for cached data; not a book, and not part of dumps or sync.
+CACHE = "_cache"
+LOAD_CACHE_FILENAME = "load.pickle"
+IMAGES_CACHE_DIRNAME = "images"
+
+# Chunk size when computing the digest of a file's content.
+FILE_DIGEST_CHUNK_SIZE = 1024 * 1024
+
+# Max number of seconds between full reconciles of the file manifest.
+MANIFEST_RECONCILE_INTERVAL = 300
+
+# Export of books to PDF or DOCX files by jobs in worker processes.
+EXPORTS_CACHE_DIRNAME = "exports"
+EXPORTS_CACHE_SIZE = 40
+EXPORT_WORKERS = 2
+EXPORT_MAX_JOBS = 100
+EXPORT_REFRESH = 2
+# Rendered chapters of DOCX files, reused when the chapter has not changed.
+DOCX_CACHE_DIRNAME = "docx"
+DOCX_CACHE_SIZE = 2000
+EXPORT_QUEUED = "queued"
+EXPORT_RUNNING = "running"
+EXPORT_DONE = "done"
+EXPORT_FAILED = "failed"
+
+# Milliseconds to collect file changes before the watcher reloads them.
+WATCH_DEBOUNCE = 50
+
+# Remote-to-local sync: local digest cache, and limits for each download batch.
+SYNC_CACHE_FILENAME = "sync.json"
+SYNC_BATCH_FILES = 200
+SYNC_BATCH_SIZE = 20 * 1024 * 1024
+
+# Maximum number of entries in the in-memory cache of parsed Markdown.
+AST_CACHE_SIZE = 2000
+
+# Maximum number of entries in the in-memory cache of rendered HTML.
+HTML_CACHE_SIZE = 1000
+
 NORMAL = "normal"
 ITALIC = "italic"
 BOLD = "bold"
@@ -133,6 +179,12 @@ FONT_STYLES = (NORMAL, ITALIC, BOLD, UNDERLINE)
 
 CHUNK_PATTERN = re.compile(r"\n$\n", re.M)
 
+# Words in the search index.
+SEARCH_TOKEN_PATTERN = re.compile(r"\w+")
+# Search terms for which the search index can be used; words and wildcards.
+SEARCH_INDEXABLE_PATTERN = re.compile(r"(?:\w|\s|\.[*?])*")
+SEARCH_SPLIT_PATTERN = re.compile(r"\.[*?]|\s+")
+
 MAX_LEVEL = 6
 
 FOOTNOTES_EACH_TEXT = "after each text"
@@ -153,6 +205,7 @@ SVG_MIMETYPE = "image/svg+xml"
 JSON_MIMETYPE = "application/json"
 PNG_MIMETYPE = "image/png"
 JPEG_MIMETYPE = "image/jpeg"
+EXPORT_MIMETYPES = dict(pdf=PDF_MIMETYPE, docx=DOCX_MIMETYPE)
 
 IMAGE_MAP = {
     SVG_MIMETYPE: "SVG",
@@ -160,6 +213,11 @@ IMAGE_MAP = {
     PNG_MIMETYPE: "PNG",
     JPEG_MIMETYPE: "JPEG",
 }
+# Binary images are stored in separate files in the images directory.
+IMAGE_FILE_EXT = {
+    PNG_MIMETYPE: ".png",
+    JPEG_MIMETYPE: ".jpg",
+}
 
 SVG_XMLNS = "http://www.w3.org/2000/svg"
 
@@ -191,6 +249,8 @@ DOCX_DEFAULT_PNG_RENDERING_FACTOR = 2.0
 
 PDF_MAX_PAGE_BREAK_LEVEL = 4
 PDF_MAX_TOC_LEVEL = 4
+# Max number of worker processes writing the chapters of a book.
+PDF_CHAPTER_WORKERS = 4
 PDF_TOC_INDENT = 15
 PDF_TOC_FONT_SIZE = 10
 PDF_TOC_LEADING = 11
@@ -1,13 +1,21 @@
-"Synchronize remote data to local directory."
+"""Synchronize remote data to local directory.
+
+Only files whose size or content digest differ from the local copy are
+downloaded, in batches of bounded size. A remote of an earlier version
+provides only the modification times of files, which are compared instead.
+Each file is written to a temporary file and moved into place only when
+complete, so an interrupted sync is resumed by the next run, which skips
+the files already in place.
+"""
 
 import datetime
 from http import HTTPStatus as HTTP
-import io
 import json
 import os
 from pathlib import Path
 import sys
 import tarfile
+import tempfile
 
 import requests
 
@@ -26,65 +34,189 @@ from timer import Timer
 timer = Timer()
 
 
-def update(url, apikey, targetdir):
-    "Get the current list of remote files, compare and update the local files."
-
-    response = requests.get(url.rstrip("/") + "/api/", headers=dict(apikey=apikey))
+def check_response(response):
+    "Raise IOError if the response is not OK."
     if response.status_code in (HTTP.BAD_GATEWAY, HTTP.SERVICE_UNAVAILABLE):
         raise IOError(f"invalid response: {response.status_code=}")
     elif response.status_code != HTTP.OK:
         raise IOError(f"invalid response: {response.status_code=} {response.content=}")
 
-    remote_files = response.json()
 
-    local_files = {}
-    targetdir = Path(targetdir)
+def read_digests_cache(targetdir):
+    "Return the cache of local file digests {name: [mtime_ns, size, digest]}."
+    filepath = targetdir / constants.CACHE / constants.SYNC_CACHE_FILENAME
+    try:
+        with open(filepath) as infile:
+            return json.load(infile)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_digests_cache(targetdir, digests):
+    "Write the cache of local file digests."
+    dirpath = targetdir / constants.CACHE
+    dirpath.mkdir(exist_ok=True)
+    filepath = dirpath / constants.SYNC_CACHE_FILENAME
+    with open(filepath.with_suffix(".tmp"), "w") as outfile:
+        json.dump(digests, outfile)
+    os.replace(filepath.with_suffix(".tmp"), filepath)
+
+
+def get_local_files(targetdir, digests):
+    """Return a dictionary {name: {modified, size, digest}} for the local files.
+    The digest is recomputed only for files whose mtime or size has changed.
+    The cache of digests is updated in place.
+    """
+    result = {}
     for dirpath, dirnames, filenames in os.walk(targetdir):
         dirpath = Path(dirpath)
+        if dirpath == targetdir and constants.CACHE in dirnames:
+            dirnames.remove(constants.CACHE)
         for filename in filenames:
             filepath = dirpath / filename
-            dt = datetime.datetime.fromtimestamp(
-                filepath.stat().st_mtime, tz=datetime.UTC
-            )
-            local_files[str(filepath.relative_to(targetdir))] = utils.str_datetime_iso(
-                dt
+            name = str(filepath.relative_to(targetdir))
+            stat = filepath.stat()
+            try:
+                mtime_ns, size, digest = digests[name]
+                if mtime_ns != stat.st_mtime_ns or size != stat.st_size:
+                    raise KeyError
+            except (KeyError, ValueError):
+                digest = utils.get_file_digest(filepath)
+                digests[name] = [stat.st_mtime_ns, stat.st_size, digest]
+            dt = datetime.datetime.fromtimestamp(stat.st_mtime, tz=datetime.UTC)
+            result[name] = dict(
+                modified=utils.str_datetime_iso(dt), size=stat.st_size, digest=digest
             )
+    for name in set(digests).difference(result):
+        digests.pop(name)
+    return result
 
-    download_files = set()
-    for name, modified in remote_files.items():
-        if (name not in local_files) or (local_files[name] != modified):
-            download_files.add(name)
 
-    if download_files:
-        response = requests.post(
-            url + "/api/download",
-            json={"files": list(download_files)},
-            headers=dict(apikey=apikey),
-        )
-        if response.status_code in (HTTP.BAD_GATEWAY, HTTP.SERVICE_UNAVAILABLE):
-            raise IOError(f"invalid response: {response.status_code=}")
-        elif response.status_code != HTTP.OK:
-            raise IOError(
-                f"invalid response: {response.status_code=} {response.content=}"
-            )
+def get_remote_files(url, apikey):
+    """Return a dictionary {name: {modified, size, digest}} for the remote files.
+    For a remote of an earlier version, which provides only {name: modified},
+    the size and digest are None.
+    """
+    response = requests.get(url.rstrip("/") + "/api/files", headers=dict(apikey=apikey))
+    if response.status_code != HTTP.NOT_FOUND:
+        check_response(response)
+        return response.json()
+    response = requests.get(url.rstrip("/") + "/api/", headers=dict(apikey=apikey))
+    check_response(response)
+    return {
+        name: dict(modified=modified, size=None, digest=None)
+        for name, modified in response.json().items()
+    }
+
+
+def is_different(local, remote):
+    """Does the local file differ from the remote file? Compare size and digest,
+    or only the modification time if the remote does not provide them.
+    """
+    if local is None:
+        return True
+    if remote["digest"] is None:
+        return local["modified"] != remote["modified"]
+    return local["size"] != remote["size"] or local["digest"] != remote["digest"]
+
+
+def get_batches(names, remote_files):
+    "Split the names into batches limited by number of files and total size."
+    batch = []
+    size = 0
+    for name in sorted(names):
+        file_size = remote_files[name]["size"] or 0
+        if batch and (
+            len(batch) >= constants.SYNC_BATCH_FILES
+            or size + file_size > constants.SYNC_BATCH_SIZE
+        ):
+            yield batch
+            batch = []
+            size = 0
+        batch.append(name)
+        size += file_size
+    if batch:
+        yield batch
+
+
+def download(url, apikey, targetdir, names, remote_files, digests):
+    """Download the named files, streaming the TGZ content. Each file is
+    verified against its remote digest, if any, before being moved into place,
+    and is given the modification time of the remote file.
+    Return the number of files downloaded.
+    """
+    response = requests.post(
+        url.rstrip("/") + "/api/download",
+        json={"files": names},
+        headers=dict(apikey=apikey),
+        stream=True,
+    )
+    check_response(response)
+    if response.headers["Content-Type"] != constants.GZIP_MIMETYPE:
+        raise IOError("invalid file type from remote")
+
+    count = 0
+    response.raw.decode_content = True
+    try:
+        with tarfile.open(fileobj=response.raw, mode="r|gz") as tf:
+            for member in tf:
+                if not member.isfile() or member.name not in remote_files:
+                    continue
+                remote = remote_files[member.name]
+                filepath = targetdir / member.name
+                filepath.parent.mkdir(parents=True, exist_ok=True)
+                infile = tf.extractfile(member)
+                with tempfile.NamedTemporaryFile(
+                    dir=filepath.parent, delete=False
+                ) as outfile:
+                    while chunk := infile.read(constants.FILE_DIGEST_CHUNK_SIZE):
+                        outfile.write(chunk)
+                tmppath = Path(outfile.name)
+                digest = utils.get_file_digest(tmppath)
+                if remote["digest"] is not None and digest != remote["digest"]:
+                    # Changed on remote since listing; get it next time.
+                    tmppath.unlink()
+                    continue
+                modified = datetime.datetime.fromisoformat(remote["modified"])
+                os.utime(tmppath, (modified.timestamp(), modified.timestamp()))
+                os.replace(tmppath, filepath)
+                stat = filepath.stat()
+                digests[member.name] = [stat.st_mtime_ns, stat.st_size, digest]
+                count += 1
+    except tarfile.TarError as message:
+        raise IOError(f"tar file error: {message}")
+    return count
 
-        if response.headers["Content-Type"] != constants.GZIP_MIMETYPE:
-            raise IOError("invalid file type from remote")
 
-        content = response.content
-        if not content:
-            raise IOError("empty TGZ file from remote")
-        try:
-            tf = tarfile.open(fileobj=io.BytesIO(content), mode="r:gz")
-            tf.extractall(path=targetdir)
-        except tarfile.TarError as message:
-            raise IOError(f"tar file error: {message}")
+def update(url, apikey, targetdir):
+    "Get the current list of remote files, compare and update the local files."
+
+    remote_files = get_remote_files(url, apikey)
+
+    targetdir = Path(targetdir)
+    digests = read_digests_cache(targetdir)
+    local_files = get_local_files(targetdir, digests)
+
+    download_files = set()
+    for name, remote in remote_files.items():
+        if is_different(local_files.get(name), remote):
+            download_files.add(name)
+
+    downloaded = 0
+    try:
+        for batch in get_batches(download_files, remote_files):
+            downloaded += download(url, apikey, targetdir, batch, remote_files, digests)
+    finally:
+        write_digests_cache(targetdir, digests)
 
     # Delete local files that do not exist in the remote.
     delete_files = set(local_files.keys()).difference(remote_files.keys())
     for name in delete_files:
         path = targetdir / name
         path.unlink()
+        digests.pop(name, None)
+    if delete_files:
+        write_digests_cache(targetdir, digests)
 
     if not download_files and not delete_files:
         return {}
@@ -92,7 +224,7 @@ def update(url, apikey, targetdir):
         result = {
             "local": len(local_files),
             "remote": len(remote_files),
-            "downloaded": len(download_files),
+            "downloaded": downloaded,
             "deleted": len(delete_files),
         }
         result.update(timer.current)
@@ -0,0 +1,279 @@
+"""Export jobs creating the PDF or DOCX file for a book in a worker process.
+The resulting file is cached on disk, keyed by the digests of the book,
+references and images together with the settings, so that a repeated
+request for the same output is served immediately.
+The state of each job is also kept on disk, so that it can be polled
+from any of the server processes, not only the one that submitted it.
+"""
+
+import concurrent.futures
+import datetime
+import json
+import multiprocessing
+import os
+from pathlib import Path
+import tempfile
+import threading
+
+import books
+import constants
+import utils
+
+
+# Jobs submitted by this process.
+# Key: job key; value: Job instance. Ordered by time of submission.
+_jobs = {}
+_lock = threading.Lock()
+_executor = None
+
+
+class Job:
+    "Export of a book to a PDF or DOCX file, with its status."
+
+    def __init__(self, key, kind, book_id, title, submitted=None):
+        self.key = key
+        self.kind = kind
+        self.book_id = book_id
+        self.title = title
+        self.submitted = submitted or datetime.datetime.now(tz=datetime.UTC)
+        # Only for a job submitted by this process.
+        self.future = None
+
+    def __str__(self):
+        return self.key
+
+    @property
+    def filepath(self):
+        return get_cache_dirpath() / f"{self.key}.{self.kind}"
+
+    @property
+    def progress_filepath(self):
+        return get_cache_dirpath() / f"{self.key}.progress"
+
+    @property
+    def state_filepath(self):
+        return get_cache_dirpath() / f"{self.key}.job"
+
+    @property
+    def state(self):
+        "Return the state of the job as last written to file."
+        return read_state(self.key)
+
+    def write_state(self, status):
+        "Write the state of the job to file."
+        write_state(
+            self.state_filepath,
+            kind=self.kind,
+            book_id=self.book_id,
+            title=self.title,
+            submitted=utils.str_datetime_iso(self.submitted),
+            status=status,
+        )
+
+    @property
+    def filename(self):
+        return f"{self.title}.{self.kind}"
+
+    @property
+    def media_type(self):
+        return constants.EXPORT_MIMETYPES[self.kind]
+
+    @property
+    def status(self):
+        if self.future is not None and not self.future.done():
+            if self.future.running():
+                return constants.EXPORT_RUNNING
+            return constants.EXPORT_QUEUED
+        if self.filepath.exists():
+            return constants.EXPORT_DONE
+        if self.future is not None:
+            return constants.EXPORT_FAILED
+        # Submitted by another process; its worker updates the state file.
+        status = self.state.get("status")
+        if status in (constants.EXPORT_QUEUED, constants.EXPORT_RUNNING):
+            return status
+        return constants.EXPORT_FAILED
+
+    @property
+    def error(self):
+        "Return the error message, if the job failed."
+        if self.future is None:
+            return self.state.get("error")
+        if not self.future.done():
+            return None
+        error = self.future.exception()
+        return error and str(error)
+
+    @property
+    def progress(self):
+        "Return the tuple (done, total) number of chapters, if known, else None."
+        try:
+            return tuple(json.loads(self.progress_filepath.read_text()))
+        except (OSError, ValueError):
+            return None
+
+
+def get_cache_dirpath():
+    "Return the directory for exported files. Create it if necessary."
+    dirpath = (
+        Path(os.environ["WRITETHATBOOK_DIR"])
+        / constants.CACHE
+        / constants.EXPORTS_CACHE_DIRNAME
+    )
+    dirpath.mkdir(parents=True, exist_ok=True)
+    return dirpath
+
+
+def get_executor():
+    """Return the pool of worker processes. Create it if necessary.
+    Each worker process is used for one job only, and is started afresh,
+    so that it reads the current state of the book from file.
+    """
+    global _executor
+    if _executor is None:
+        _executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=constants.EXPORT_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            max_tasks_per_child=1,
+        )
+    return _executor
+
+
+def get_key(kind, book, settings):
+    "Return the key for the export of the book with the given settings."
+    return utils.get_digest(
+        json.dumps(
+            [
+                kind,
+                constants.__version__,
+                book.id,
+                book.digest,
+                books.get_refs().digest,
+                books.get_imgs().digest,
+                settings,
+            ],
+            sort_keys=True,
+        )
+    )
+
+
+def get_job(key):
+    """Return the job given its key, or None if no such job.
+    A job submitted by another process is read from its state file.
+    """
+    job = _jobs.get(key)
+    if job is not None:
+        return job
+    state = read_state(key)
+    if not state:
+        return None
+    return Job(
+        key,
+        state["kind"],
+        state["book_id"],
+        state["title"],
+        submitted=datetime.datetime.fromisoformat(state["submitted"]),
+    )
+
+
+def read_state(key):
+    "Return the state of the job from its file, or an empty dictionary if none."
+    if not key.isalnum():
+        return {}
+    try:
+        return json.loads((get_cache_dirpath() / f"{key}.job").read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def write_state(filepath, **state):
+    "Write the state of a job to its file, replacing it in one step."
+    with tempfile.NamedTemporaryFile("w", dir=filepath.parent, delete=False) as outfile:
+        json.dump(state, outfile)
+    os.replace(outfile.name, filepath)
+
+
+def submit(kind, book, settings):
+    """Return the job for the export of the book with the given settings.
+    A new job is started only if the output is neither cached nor in progress.
+    """
+    key = get_key(kind, book, settings)
+    with _lock:
+        job = _jobs.get(key)
+        if job is not None and job.status != constants.EXPORT_FAILED:
+            return job
+        job = Job(key, kind, book.id, book.title)
+        if not job.filepath.exists():
+            job.write_state(constants.EXPORT_QUEUED)
+            job.future = get_executor().submit(
+                run, kind, book.id, settings, job.filepath, job.progress_filepath
+            )
+        _jobs.pop(key, None)
+        _jobs[key] = job
+        while len(_jobs) > constants.EXPORT_MAX_JOBS:
+            _jobs.pop(next(iter(_jobs)))
+    cleanup()
+    return job
+
+
+def cleanup():
+    """Remove the oldest exported files beyond the maximum number to keep,
+    and the oldest job state files beyond the maximum number of jobs.
+    """
+    filepaths = []
+    statepaths = []
+    for filepath in get_cache_dirpath().iterdir():
+        if filepath.suffix[1:] in constants.EXPORT_MIMETYPES:
+            filepaths.append(filepath)
+        elif filepath.suffix == ".job":
+            statepaths.append(filepath)
+    for paths, size in [
+        (filepaths, constants.EXPORTS_CACHE_SIZE),
+        (statepaths, constants.EXPORT_MAX_JOBS),
+    ]:
+        paths.sort(key=get_mtime, reverse=True)
+        for filepath in paths[size:]:
+            filepath.unlink(missing_ok=True)
+
+
+def get_mtime(filepath):
+    "Return the modification time of the file, or 0 if it has been removed."
+    try:
+        return filepath.stat().st_mtime
+    except FileNotFoundError:
+        return 0
+
+
+def run(kind, id, settings, filepath, progress_filepath):
+    "Create the exported file for the book. Executed in a worker process."
+    if kind == "pdf":
+        from apps.pdf import BookWriter
+    else:
+        from apps.docx import BookWriter
+
+    state_filepath = filepath.with_suffix(".job")
+    state = read_state(filepath.stem)
+    state["status"] = constants.EXPORT_RUNNING
+    write_state(state_filepath, **state)
+    try:
+        book = books.load_book(id)
+        book.frontmatter[kind] = settings
+        writer = BookWriter(book)
+
+        def progress(done, total):
+            progress_filepath.write_text(json.dumps([done, total]))
+
+        writer.progress = progress
+        content = writer.get_content()
+        # Write to a temporary file first, so that readers never see a partial file.
+        with tempfile.NamedTemporaryFile(dir=filepath.parent, delete=False) as outfile:
+            outfile.write(content)
+        os.replace(outfile.name, filepath)
+        state["status"] = constants.EXPORT_DONE
+        write_state(state_filepath, **state)
+    except Exception as error:
+        state.update(status=constants.EXPORT_FAILED, error=str(error))
+        write_state(state_filepath, **state)
+        raise
+    finally:
+        progress_filepath.unlink(missing_ok=True)
@@ -0,0 +1,158 @@
+"""Image data and conversions, with the results cached on disk.
+The data of PNG and JPEG images is stored in separate files in the images
+directory; the 'file' entry in the image frontmatter gives the file name.
+"""
+
+import base64
+import hashlib
+import json
+import os
+from pathlib import Path
+import tempfile
+
+import vl_convert
+
+import constants
+import manifest
+import minixml
+import utils
+
+
+def get_cache_dirpath():
+    "Return the directory for cached image conversions. Create it if necessary."
+    dirpath = (
+        Path(os.environ["WRITETHATBOOK_DIR"])
+        / constants.CACHE
+        / constants.IMAGES_CACHE_DIRNAME
+    )
+    dirpath.mkdir(parents=True, exist_ok=True)
+    return dirpath
+
+
+def get_cached(filename):
+    "Return the cached data for the filename, or None if not cached."
+    try:
+        with open(get_cache_dirpath() / filename, "rb") as infile:
+            return infile.read()
+    except OSError:
+        return None
+
+
+def set_cached(filename, data):
+    "Store the data for the filename in the cache."
+    dirpath = get_cache_dirpath()
+    # Write to a temporary file first, so that readers never see a partial file.
+    with tempfile.NamedTemporaryFile(dir=dirpath, delete=False) as outfile:
+        outfile.write(data)
+    os.replace(outfile.name, dirpath / filename)
+
+
+def vegalite_to_svg(spec):
+    """Convert the Vega-Lite specification JSON text to SVG text.
+    Cached by the digest of the specification.
+    """
+    filename = f"{utils.get_digest(spec)}.svg"
+    data = get_cached(filename)
+    if data is None:
+        data = vl_convert.vegalite_to_svg(json.loads(spec)).encode("utf-8")
+        set_cached(filename, data)
+    return data.decode("utf-8")
+
+
+def svg_to_png(svg):
+    """Convert the SVG text to PNG data.
+    Cached by the digest of the SVG text, which includes the size of the image.
+    """
+    filename = f"{utils.get_digest(svg)}.png"
+    data = get_cached(filename)
+    if data is None:
+        data = vl_convert.svg_to_png(svg)
+        set_cached(filename, data)
+    return data
+
+
+def get_data(img):
+    """Return the binary data for the PNG or JPEG image.
+    Decode from the frontmatter if not yet moved into a separate file.
+    """
+    try:
+        filename = img["file"]
+    except KeyError:
+        return base64.standard_b64decode(img["data"])
+    with open(img.book.abspath / filename, "rb") as infile:
+        return infile.read()
+
+
+def set_data(img, data):
+    """Store the binary data for the PNG or JPEG image in a separate file.
+    The content type of the image must have been set.
+    The image must be written for the change to be saved.
+    """
+    filename = img["id"] + constants.IMAGE_FILE_EXT[img["content_type"]]
+    with open(img.book.abspath / filename, "wb") as outfile:
+        outfile.write(data)
+    manifest.update(img.book.abspath / filename)
+    # The file extension changes if the image changes between PNG and JPEG.
+    if img.get("file") not in (None, filename):
+        remove_data(img)
+    img.set("data", None)
+    img.set("base64", None)
+    img["file"] = filename
+    # The digest of the data ensures that the digest of the image changes.
+    img["file_digest"] = hashlib.md5(data).hexdigest()
+
+
+def remove_data(img):
+    "Remove the separate file for the image data, if any."
+    try:
+        (img.book.abspath / img["file"]).unlink(missing_ok=True)
+        manifest.update(img.book.abspath / img["file"])
+    except KeyError:
+        pass
+
+
+def migrate(imgs):
+    "Move the data of PNG and JPEG images from the frontmatter into separate files."
+    for img in imgs:
+        if img["content_type"] not in constants.IMAGE_FILE_EXT:
+            continue
+        if "data" not in img.frontmatter:
+            continue
+        set_data(img, base64.standard_b64decode(img["data"]))
+        img.write(force=True)
+
+
+def get_svg(img):
+    "Return the SVG text for the SVG or Vega-Lite image."
+    if img["content_type"] == constants.SVG_MIMETYPE:
+        return img["data"]
+    else:
+        return vegalite_to_svg(img["data"])
+
+
+def get_svg_root(img):
+    """Return the minixml root element for the SVG or Vega-Lite image.
+    The viewbox is set so that scaling behaves.
+    """
+    root = minixml.parse_content(get_svg(img))
+    root["viewBox"] = f"0 0 {root['width']} {root['height']}"
+    return root
+
+
+def get_png(img, factor):
+    "Return the PNG data for the SVG or Vega-Lite image, its size scaled by factor."
+    root = get_svg_root(img)
+    root["width"] = factor * float(root["width"])
+    root["height"] = factor * float(root["height"])
+    return svg_to_png(repr(root))
+
+
+def convert(img):
+    "Perform the conversions for the image that display and export will need."
+    if img["content_type"] not in (constants.SVG_MIMETYPE, constants.JSON_MIMETYPE):
+        return
+    get_svg(img)
+    pdf = img["pdf"]
+    if not pdf["reportlab_graphics"]:
+        get_png(img, pdf["png_rendering_factor"] * pdf["scale_factor"])
+    get_png(img, img["docx"]["png_rendering_factor"])
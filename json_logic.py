@@ -95,8 +95,13 @@ def merge(*args):
 
 def get_var(data, var_name, not_found=None):
     """Gets variable value from instance member or data dictionary."""
+    return get_var_keys(data, str(var_name).split("."), not_found)
+
+
+def get_var_keys(data, keys, not_found=None):
+    """Gets variable value given the keys of the already split variable name."""
     try:
-        for key in str(var_name).split("."):
+        for key in keys:
             # Added attempt to get attribute. /Per Kraulis
             try:
                 data = getattr(data, key)
@@ -202,6 +207,55 @@ def evaluate(tests, data=None):
     return operations[operator](*values)
 
 
+def compile_logic(tests):
+    """Compiles the json-logic into a function of the data, giving the same
+    result as 'evaluate', but without interpreting the json-logic each time.
+    """
+    function = compile_tests(tests)
+
+    def evaluate_compiled(data=None):
+        return function(data or {})
+
+    return evaluate_compiled
+
+
+def compile_tests(tests):
+    """Returns the function of the data for the json-logic. Added by Per Kraulis."""
+    # A primitive; its value is a constant.
+    if tests is None or not isinstance(tests, dict):
+        return lambda data: tests
+
+    operator = list(tests.keys())[0]
+    values = tests[operator]
+    if not isinstance(values, list) and not isinstance(values, tuple):
+        values = [values]
+
+    # Variable with a constant name; split it only once.
+    if operator == "var" and not isinstance(values[0], dict):
+        keys = str(values[0]).split(".")
+        not_found = values[1] if len(values) > 1 else None
+        if not isinstance(not_found, dict):
+            return lambda data: get_var_keys(data, keys, not_found)
+
+    functions = [compile_tests(val) for val in values]
+
+    if operator == "var":
+        return lambda data: get_var(data, *[f(data) for f in functions])
+    if operator == "missing":
+        return lambda data: missing(data, *[f(data) for f in functions])
+    if operator == "missing_some":
+        return lambda data: missing_some(data, *[f(data) for f in functions])
+
+    if operator not in operations:
+        raise ValueError("Unrecognized operation %s" % operator)
+    operation = operations[operator]
+
+    if len(functions) == 1:
+        function = functions[0]
+        return lambda data: operation(function(data))
+    return lambda data: operation(*[f(data) for f in functions])
+
+
 if __name__ == "__main__":
     print(evaluate({"not": {"var": "blah"}}, data=dict(blah=True)))
     print(evaluate({"not": {"var": "blah"}}, data=dict(blah=False)))
@@ -7,9 +7,7 @@ from icecream import install
 
 install()
 
-import io
 import os
-import tarfile
 
 from fasthtml.common import *
 
@@ -33,9 +31,24 @@ from errors import *
 import users
 import utils
 from utils import Tx
+import watcher
 
 
-app, rt = components.get_fast_app(routes=apps.routes)
+def startup():
+    """Initialize the app when the server starts, rather than when this module
+    is imported, which is also done in the spawned export worker processes.
+    """
+    # Initialize the users database.
+    users.initialize()
+
+    # Read in all books and references into memory.
+    books.read_books()
+
+    # Reload files changed outside of this app, if enabled.
+    watcher.start()
+
+
+app, rt = components.get_fast_app(routes=apps.routes, on_startup=[startup])
 
 
 @rt("/")
@@ -85,13 +98,14 @@ def get(request):
     auth.allow_admin(request)
 
     filename = f"writethatbook_{utils.str_datetime_safe()}.tgz"
-    buffer = io.BytesIO()
-    with tarfile.open(fileobj=buffer, mode="w:gz") as tgzfile:
-        for path in Path(os.environ["WRITETHATBOOK_DIR"]).iterdir():
-            tgzfile.add(path, arcname=path.name, recursive=True)
-
-    return Response(
-        content=buffer.getvalue(),
+    entries = [
+        (path, path.name)
+        for path in sorted(Path(os.environ["WRITETHATBOOK_DIR"]).iterdir())
+        if path.name != constants.CACHE
+    ]
+
+    return StreamingResponse(
+        utils.stream_tgz(entries),
         media_type=constants.GZIP_MIMETYPE,
         headers={"Content-Disposition": f'attachment; filename="{filename}"'},
     )
@@ -103,17 +117,11 @@ def get(request, book: books.Book):
     auth.authorize(request, *auth.book_view, book=book)
 
     filename = f"writethatbook_{book}_{utils.str_datetime_safe()}.tgz"
-    return Response(
-        content=book.get_tgz_content(),
+    return StreamingResponse(
+        utils.stream_tgz(book.get_tgz_entries()),
         media_type=constants.GZIP_MIMETYPE,
         headers={"Content-Disposition": f'attachment; filename="{filename}"'},
     )
 
 
-# Initialize the users database.
-users.initialize()
-
-# Read in all books and references into memory.
-books.read_books()
-
 serve()
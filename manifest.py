@@ -0,0 +1,159 @@
+"""In-memory manifest of the files in the data directory.
+Each entry gives the size, modification time and content digest of a file.
+The write operations on books, images and users update the affected entries.
+A full reconcile with the directory is done at most every so often, to catch
+any changes made outside of this app.
+"""
+
+import datetime
+import os
+from pathlib import Path
+import threading
+import time
+
+import constants
+import utils
+
+
+# Key: file name relative to the data directory; value: dict(size, mtime_ns, digest)
+# The digest is computed when first required.
+_entries = {}
+_lock = threading.Lock()
+_reconciled = None
+
+
+def get_dirpath():
+    "Return the path of the data directory."
+    return Path(os.environ["WRITETHATBOOK_DIR"])
+
+
+def get_name(path):
+    """Return the name of the file or directory relative to the data directory.
+    Return None if outside of it, or in the cache directory.
+    """
+    try:
+        name = Path(path).relative_to(get_dirpath()).as_posix()
+    except ValueError:
+        return None
+    if name == constants.CACHE or name.startswith(constants.CACHE + "/"):
+        return None
+    return name
+
+
+def scan(path, name):
+    "Return the entries {name: entry} for the file, or all files below the directory."
+    result = {}
+    if path.is_dir():
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirpath = Path(dirpath)
+            if dirpath == get_dirpath() and constants.CACHE in dirnames:
+                dirnames.remove(constants.CACHE)
+            for filename in filenames:
+                filepath = dirpath / filename
+                try:
+                    stat = filepath.stat()
+                except FileNotFoundError:  # Removed while scanning.
+                    continue
+                result[get_name(filepath)] = dict(
+                    size=stat.st_size, mtime_ns=stat.st_mtime_ns, digest=None
+                )
+    else:
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            pass
+        else:
+            result[name] = dict(
+                size=stat.st_size, mtime_ns=stat.st_mtime_ns, digest=None
+            )
+    return result
+
+
+def update(*paths):
+    """Update the entries for the given files or directories, which may have
+    been created, modified or removed. Directories are updated recursively.
+    """
+    if _reconciled is None:  # Not yet initialized; nothing to update.
+        return
+    for path in paths:
+        path = Path(path)
+        name = get_name(path)
+        if name is None:
+            continue
+        entries = scan(path, name)
+        with _lock:
+            # A file, existing or removed, has only its own entry. Otherwise it
+            # is a directory, existing or removed; all entries below it are found.
+            if name in entries or name in _entries:
+                keys = [name] if name in _entries else []
+            else:
+                prefix = name + "/"
+                keys = [k for k in _entries if k.startswith(prefix)]
+            for key in keys:
+                entry = _entries.pop(key)
+                # Keep the digest if the file has not changed.
+                new = entries.get(key)
+                if (
+                    new
+                    and new["size"] == entry["size"]
+                    and new["mtime_ns"] == entry["mtime_ns"]
+                ):
+                    new["digest"] = entry["digest"]
+            _entries.update(entries)
+
+
+def reconcile():
+    "Update the entire manifest from the data directory."
+    global _reconciled
+    entries = scan(get_dirpath(), ".")
+    with _lock:
+        for name, entry in entries.items():
+            old = _entries.get(name)
+            if (
+                old
+                and old["size"] == entry["size"]
+                and old["mtime_ns"] == entry["mtime_ns"]
+            ):
+                entry["digest"] = old["digest"]
+        _entries.clear()
+        _entries.update(entries)
+        _reconciled = time.monotonic()
+
+
+def check_reconcile():
+    "Reconcile the manifest if not done within the set interval."
+    if (
+        _reconciled is None
+        or time.monotonic() - _reconciled > constants.MANIFEST_RECONCILE_INTERVAL
+    ):
+        reconcile()
+
+
+def get_entries():
+    """Return a dictionary {name: dict(modified, size, digest)} for all files.
+    Digests not yet known are computed.
+    """
+    check_reconcile()
+    with _lock:
+        entries = list(_entries.items())
+    result = {}
+    for name, entry in entries:
+        if entry["digest"] is None:
+            try:
+                entry["digest"] = utils.get_file_digest(get_dirpath() / name)
+            except FileNotFoundError:  # Removed since last update.
+                continue
+        dt = datetime.datetime.fromtimestamp(entry["mtime_ns"] / 1e9, tz=datetime.UTC)
+        result[name] = dict(
+            modified=utils.str_datetime_iso(dt),
+            size=entry["size"],
+            digest=entry["digest"],
+        )
+    return result
+
+
+def get_total_size():
+    "Return the total size of all files."
+    check_reconcile()
+    with _lock:
+        return sum(entry["size"] for entry in _entries.values())
@@ -1,8 +1,8 @@
 "Markdown parser."
 
 import html
-import json
 import re
+import threading
 import urllib.parse
 
 import marko
@@ -11,28 +11,13 @@ import marko.ast_renderer
 import marko.inline
 import marko.helpers
 
-import vl_convert
-
 import constants
 from errors import *
+import images
 import utils
 from utils import Tx
 
 
-# Globals; yes, awful coding, but it works...
-
-# 1) Creating URL for indexed word requires knowing the book.
-_current_book = None  # Required for index links.
-
-# 2) URL for editing an item.
-_current_edit_href = None
-
-
-def get_index_href(canonical):
-    global _current_book
-    return f"/meta/index/{_current_book}#{canonical}"
-
-
 class Subscript(marko.inline.InlineElement):
     "Markdown extension for subscript."
 
@@ -94,14 +79,19 @@ class Indexed(marko.inline.InlineElement):
 
 
 class IndexedRenderer:
-    "Output a link to the index page and item."
+    """Output a link to the index page and item.
+    Requires the book of the render context; otherwise no link.
+    """
 
     def render_indexed(self, element):
         if element.term == element.canonical:
             title = utils.Tx("Indexed")
         else:
             title = utils.Tx("Indexed") + ": " + element.canonical
-        return f'<a class="contrast" title="{title}" href="{get_index_href(element.canonical)}">{element.term}</a>'
+        if self.context.book is None:
+            return f'<span title="{title}">{element.term}</span>'
+        href = f"/meta/index/{self.context.book}#{element.canonical}"
+        return f'<a class="contrast" title="{title}" href="{href}">{element.term}</a>'
 
 
 class Reference(marko.inline.InlineElement):
@@ -160,29 +150,50 @@ class ChunkmarkRenderer:
     "Output the chunk number and edit button."
 
     def render_chunkmark(self, element):
-        global _current_book
-        global _current_edit_href
-        if _current_book.chunk_numbers:
+        if self.context.chunk_numbers:
             result = [f'<mark id="{element.nchunk}">{element.nchunk}.</mark>']
         else:
             result = [f'<span id="{element.nchunk}"></span>']
-        if _current_edit_href:
+        if self.context.edit_href:
             result.append(
-                f'<a href="{_current_edit_href}?nchunk={element.nchunk}" title="{Tx("Edit chunk")}"><img src="/edit.svg" class="white no-print"></a>'
+                f'<a href="{self.context.edit_href}?nchunk={element.nchunk}" title="{Tx("Edit chunk")}"><img src="/edit.svg" class="white no-print"></a>'
             )
         return " ".join(result) + "\n"
 
 
-def to_ast(content):
-    "Convert Markdown content into an AST structure."
-    converter = marko.Markdown(renderer=marko.ast_renderer.ASTRenderer)
-    converter.use("footnote")
-    converter.use(
-        marko.helpers.MarkoExtension(
-            elements=[Subscript, Superscript, Emdash, Indexed, Reference, Comment],
+# Parsed Markdown; key: digest of content, value: AST structure.
+_ast_cache = utils.LruCache(constants.AST_CACHE_SIZE)
+
+# Converter instances are not thread-safe, so one is kept per thread.
+_local = threading.local()
+
+
+def get_ast_converter():
+    "Return the Markdown-to-AST converter for this thread, creating it if needed."
+    try:
+        return _local.ast_converter
+    except AttributeError:
+        converter = marko.Markdown(renderer=marko.ast_renderer.ASTRenderer)
+        converter.use("footnote")
+        converter.use(
+            marko.helpers.MarkoExtension(
+                elements=[Subscript, Superscript, Emdash, Indexed, Reference, Comment],
+            )
         )
-    )
-    return converter.convert(content)
+        _local.ast_converter = converter
+        return converter
+
+
+def to_ast(content):
+    """Convert Markdown content into an AST structure.
+    The result is cached and shared; it must not be modified.
+    """
+    key = utils.get_digest(content)
+    ast = _ast_cache.get(key)
+    if ast is None:
+        ast = get_ast_converter().convert(content)
+        _ast_cache.set(key, ast)
+    return ast
 
 
 class HtmlRenderer(marko.html_renderer.HTMLRenderer):
@@ -243,20 +254,42 @@ class HtmlRenderer(marko.html_renderer.HTMLRenderer):
             return f'<article>{img["data"]}{footer}</article>'
         # Vega-Lite, convert to SVG. 'title' is not used.
         elif img["content_type"] == constants.JSON_MIMETYPE:
-            svg = vl_convert.vegalite_to_svg(json.loads(img["data"]))
+            svg = images.vegalite_to_svg(img["data"])
             return f"<article>{svg}{footer}</article>"
-        # One of PNG or JPEG, use inline variant. Set title if not done.
+        # One of PNG or JPEG, fetched separately. Set title if not done.
         else:
             if not title:
                 title = f' title="{self.escape_html(img.title)}"'
-            src = f'data:{img["content_type"]};base64, {img["data"]}'
+            src = f'/imgs/raw/{img["id"]}'
             return f'<article><img src="{src}" {title} />{footer}</article>'
 
 
+class RenderContext:
+    """Settings for rendering HTML; the book, if any, and the edit link.
+    Kept by the renderer instance, so that renders do not interfere
+    with each other when done concurrently.
+    """
+
+    def __init__(self, book=None, edit_href=None):
+        self.book = book
+        self.edit_href = edit_href
+
+    @property
+    def chunk_numbers(self):
+        return bool(self.book is not None and self.book.chunk_numbers)
+
+    @property
+    def key(self):
+        "Key for the cache of rendered HTML."
+        return (str(self.book), self.chunk_numbers, self.edit_href)
+
+
 class Markdown2Html(marko.Markdown):
-    "Add new elements and extended HTML display features."
+    """Add new elements and extended HTML display features.
+    A new instance must be used for each render context.
+    """
 
-    def __init__(self):
+    def __init__(self, context):
         super().__init__(renderer=HtmlRenderer)
         self.use("footnote")
         self.use(
@@ -283,6 +316,7 @@ class Markdown2Html(marko.Markdown):
             )
         )
         self._setup_extensions()
+        self.renderer.context = context
 
     def parse(self, text):
         chunked = Chunked(text)
@@ -290,13 +324,25 @@ class Markdown2Html(marko.Markdown):
         return super().parse(chunked.content)
 
 
+# Rendered HTML; key: digest of content and the settings used, value: HTML.
+_html_cache = utils.LruCache(constants.HTML_CACHE_SIZE)
+
+
 def to_html(content, book=None, edit_href=None):
-    global _current_book  # Required for index links.
-    if book is not None:
-        _current_book = book  # Required for index links generated in the next call.
-    global _current_edit_href  # Required for editing chunk.
-    _current_edit_href = edit_href
-    return Markdown2Html().convert(content)
+    """Convert Markdown content into HTML.
+    The book is required for index links and chunk number display.
+    The result is cached; the key includes the render context and
+    the digest of the images library, since these affect the output.
+    """
+    from books import get_imgs  # To avoid circular import.
+
+    context = RenderContext(book=book, edit_href=edit_href)
+    key = (utils.get_digest(content), get_imgs().digest) + context.key
+    html = _html_cache.get(key)
+    if html is None:
+        html = Markdown2Html(context).convert(content)
+        _html_cache.set(key, html)
+    return html
 
 
 class Chunked:
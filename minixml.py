@@ -240,10 +240,12 @@ class DefaultContentHandler(xml.sax.ContentHandler):
             self.stack[-1].subelements.append(xml.sax.saxutils.unescape(content))
 
 
-def parse(filename_or_stream, content_handler=DefaultContentHandler()):
+def parse(filename_or_stream, content_handler=None):
     """Parse the file given by its path, or an open file object.
     Returns the root XML element.
     """
+    if content_handler is None:
+        content_handler = DefaultContentHandler()
     try:
         xml.sax.parse(filename_or_stream, content_handler)
     except xml.sax.SAXException as error:
@@ -5,10 +5,12 @@ import os
 from pathlib import Path
 import uuid
 
+import apsw
 import yaml
 
 import constants
 from errors import *
+import manifest
 import utils
 
 
@@ -66,15 +68,24 @@ class User:
 
 
 class Database:
-    "In-memory users database."
+    """In-memory users database, persisted in an SQLite file.
+    The file is read on first use, and is created when first written.
+    Only the users created, changed or deleted are written, in a single
+    transaction, at the end of every 'with' block of edits.
+    Indexes for lookup by email and API key are built when the database
+    is read, and are updated for the users written.
+    """
 
     def __init__(self):
         self.filepath = (
             Path(os.environ["WRITETHATBOOK_DIR"]) / constants.USERS_DATABASE_FILENAME
         )
-        self.read()
+        # Not read until used, so that importing this module opens no file.
+        self.users = None
+        self.stat = None
 
     def __enter__(self):
+        self.load()
         return self
 
     def __exit__(self, type, value, tb):
@@ -83,62 +94,168 @@ class Database:
         return False
 
     def __len__(self):
+        self.load()
         return len(self.users)
 
+    def load(self):
+        "Read the database, if not already done."
+        if self.users is None:
+            self.read()
+
+    def connect(self):
+        """Return a connection to the database file, creating the table if needed.
+        A new connection is used for each operation, since the file may be
+        replaced, e.g. by the sync cron job.
+        """
+        connection = apsw.Connection(str(self.filepath))
+        connection.set_busy_timeout(constants.USERS_DATABASE_TIMEOUT)
+        connection.execute("PRAGMA synchronous=FULL")
+        columns = ", ".join(f"{key} TEXT" for key in User._keys)
+        connection.execute(
+            f"CREATE TABLE IF NOT EXISTS users (id TEXT PRIMARY KEY, {columns})"
+        )
+        return connection
+
     def read(self):
         "Read the entire database."
+        if not self.filepath.exists():
+            self.migrate()
         self.users = {}
-        try:
-            with self.filepath.open() as infile:
-                for data in yaml.safe_load(infile.read())["users"]:
-                    id = data.pop("id")
-                    self.users[id] = User(id, **data)
-        except FileNotFoundError:
-            pass
+        # No file yet, or not even the data directory; created when written.
+        if self.filepath.exists():
+            connection = self.connect()
+            try:
+                columns = ", ".join(User._keys)
+                for id, *values in connection.execute(
+                    f"SELECT id, {columns} FROM users"
+                ):
+                    self.users[id] = User(id, **dict(zip(User._keys, values)))
+            finally:
+                connection.close()
+        # Key: userid; value: user data as last read or written.
+        self.saved = dict((id, u.to_dict()) for id, u in self.users.items())
+        self.index()
+        self.stat = utils.get_stat(self.filepath)
 
     def write(self):
-        "Write the entire database."
-        with self.filepath.open("w") as outfile:
-            outfile.write(
-                yaml.dump(
-                    dict(users=list(u.to_dict() for u in self.users.values())),
-                    allow_unicode=True,
-                )
-            )
+        "Write the users created, changed or deleted since last read or written."
+        current = dict((id, u.to_dict()) for id, u in self.users.items())
+        changed = [data for id, data in current.items() if data != self.saved.get(id)]
+        deleted = [(id,) for id in self.saved if id not in current]
+        for (id,) in deleted:
+            self.unindex(self.saved[id])
+        for data in changed:
+            saved = self.saved.get(data["id"])
+            if saved is None:
+                self.index_user(self.users[data["id"]])
+            elif (saved["email"], saved["apikey"]) != (data["email"], data["apikey"]):
+                self.unindex(saved)
+                self.index_user(self.users[data["id"]])
+        if changed or deleted:
+            keys = ["id"] + User._keys
+            connection = self.connect()
+            try:
+                with connection:  # Transaction.
+                    connection.executemany(
+                        f"INSERT OR REPLACE INTO users ({', '.join(keys)})"
+                        f" VALUES ({', '.join(['?'] * len(keys))})",
+                        [[data[key] for key in keys] for data in changed],
+                    )
+                    connection.executemany("DELETE FROM users WHERE id=?", deleted)
+            finally:
+                connection.close()
+            manifest.update(self.filepath)
+        self.saved = current
+        self.stat = utils.get_stat(self.filepath)
+
+    def migrate(self):
+        """Move the users from the YAML file used by previous versions, if any,
+        into the database. The YAML file is kept, renamed.
+        """
+        filepath = self.filepath.with_name(constants.USERS_YAML_FILENAME)
+        try:
+            with filepath.open() as infile:
+                data = yaml.safe_load(infile.read())["users"]
+        except FileNotFoundError:
+            return
+        self.users = {}
+        self.saved = {}
+        for user in data:
+            id = user.pop("id")
+            self.users[id] = User(id, **user)
+        self.index()
+        self.write()
+        filepath.rename(filepath.with_suffix(".yaml.migrated"))
+        manifest.update(filepath, filepath.with_suffix(".yaml.migrated"))
+        print("Initialize users: migrated to", self.filepath)
+
+    def index(self):
+        "Build the indexes for lookup of users by email and API key."
+        # Key: email or API key; value: User instance.
+        self.emails = {}
+        self.apikeys = {}
+        for user in self.users.values():
+            self.index_user(user)
+
+    def index_user(self, user):
+        "Add the user to the indexes. The first user with an email keeps it."
+        if user.email:
+            self.emails.setdefault(user.email, user)
+        if user.apikey:
+            self.apikeys[user.apikey] = user
+
+    def unindex(self, data):
+        """Remove the user from the indexes, given its data as last read or written.
+        Another user with the same email, if any, then takes its place.
+        """
+        email = data.get("email")
+        if email and getattr(self.emails.get(email), "id", None) == data["id"]:
+            self.emails.pop(email)
+            for user in self.users.values():
+                if user.email == email and user.id != data["id"]:
+                    self.emails[email] = user
+                    break
+        apikey = data.get("apikey")
+        if apikey and getattr(self.apikeys.get(apikey), "id", None) == data["id"]:
+            self.apikeys.pop(apikey)
 
     def __getitem__(self, key):
         """Get the user given the userid.
         Otherwise raise KeyError.
         """
-        for user in self.users.values():
-            if user.id == key:
-                return user
-        raise KeyError(f"no such user '{key}'")
-
-    def __contains__(self, key):
+        self.load()
         try:
-            bool(self[key])
+            return self.users[key]
         except KeyError:
-            return False
+            raise KeyError(f"no such user '{key}'")
+
+    def __contains__(self, key):
+        self.load()
+        return key in self.users
 
     def get(self, userid=None, email=None, apikey=None, default=None):
         "Get the user given the userid, email or API key, or return default value."
-        try:
-            if userid:
+        self.load()
+        if userid:
+            try:
                 return self[userid]
-        except KeyError:
-            pass
-        for user in self.users.values():
-            if email and user.email == email:
-                return user
-            if user.apikey == apikey:
+            except KeyError:
+                pass
+        # The indexed user may have been edited since the last write.
+        if email:
+            user = self.emails.get(email)
+            if user is not None and user.email == email:
                 return user
         if apikey:
+            user = self.apikeys.get(apikey)
+            if user is not None and user.apikey == apikey:
+                return user
             raise InvalidApiKey
         return default
 
     def create_user(self, userid, role=constants.USER_ROLE):
         "Create a new user. NOTE: Does not write out the database."
+        self.load()
         if userid in self:
             raise KeyError(f"user '{userid}' already registered")
         if not utils.valid_id(userid):
@@ -149,6 +266,7 @@ class Database:
         return user
 
     def all(self):
+        self.load()
         for u in sorted(self.users.values(), key=lambda u: u.id):
             yield u
 
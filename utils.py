@@ -1,11 +1,14 @@
 "Various simple utility functions."
 
+import collections
 import csv
 import datetime
 import hashlib
 import os
 import re
 import string
+import tarfile
+import threading
 import time
 import unicodedata
 
@@ -31,6 +34,24 @@ def get_digest(content, digest=None):
     return get_digest_instance(content, digest=digest).hexdigest()
 
 
+def get_file_digest(filepath):
+    "Return the hex digest code for the content of the file, read in chunks."
+    digest = hashlib.md5()
+    with open(filepath, "rb") as infile:
+        while chunk := infile.read(constants.FILE_DIGEST_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_stat(filepath):
+    "Return the tuple (size, mtime_ns) for the file, or None if it does not exist."
+    try:
+        stat = filepath.stat()
+        return (stat.st_size, stat.st_mtime_ns)
+    except FileNotFoundError:
+        return None
+
+
 def short_person_name(name):
     "Return the person name in short form; given names as initials."
     parts = [p.strip() for p in name.split(",")]
@@ -161,3 +182,82 @@ class Timer:
 
     def restart(self):
         self.start = time.process_time()
+
+
+class ChunkBuffer:
+    "File-like object collecting the data written to it, to be taken out in chunks."
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def take(self):
+        "Return the data written since last time."
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def walk_tgz_entries(path, arcname):
+    """Yield the tuples (path, arcname) for the file or directory,
+    and all files and directories below it.
+    """
+    yield (path, arcname)
+    if path.is_dir():
+        for child in sorted(path.iterdir()):
+            yield from walk_tgz_entries(child, f"{arcname}/{child.name}")
+
+
+def stream_tgz(entries):
+    """Generate chunks of a gzipped tar file containing the given entries,
+    each of which is a tuple (path, arcname). Directories are added recursively.
+    Only the compressed data for the current file is held in memory.
+    """
+    buffer = ChunkBuffer()
+    with tarfile.open(fileobj=buffer, mode="w|gz") as tgzfile:
+        for path, arcname in entries:
+            for path, arcname in walk_tgz_entries(path, arcname):
+                try:
+                    tgzfile.add(path, arcname=arcname, recursive=False)
+                except FileNotFoundError:  # Removed while streaming.
+                    continue
+                data = buffer.take()
+                if data:
+                    yield data
+    yield buffer.take()
+
+
+class LruCache:
+    "Thread-safe cache which discards the least recently used entries when full."
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        "Return the value for the key, or the default if not in the cache."
+        with self.lock:
+            try:
+                self.entries.move_to_end(key)
+            except KeyError:
+                return default
+            return self.entries[key]
+
+    def set(self, key, value):
+        "Set the value for the key, discarding the oldest entries if full."
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
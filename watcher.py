@@ -0,0 +1,93 @@
+"""Optional watcher of the data directory, enabled by the environment variable
+WRITETHATBOOK_WATCH. Files changed outside of this app, e.g. by an editor,
+a git pull or the sync cron job, are reloaded into the in-memory database.
+A changed text or section is reloaded by itself. A book is reread only when
+its structure has changed, i.e. files or directories were added or removed.
+"""
+
+import atexit
+import os
+from pathlib import Path
+import threading
+
+import watchfiles
+
+import books
+import constants
+import manifest
+import users
+import utils
+
+
+_thread = None
+_stop_event = threading.Event()
+
+
+def get_dirpath():
+    "Return the path of the data directory."
+    return Path(os.environ["WRITETHATBOOK_DIR"])
+
+
+def watch_filter(change, path):
+    "Skip the cache directory and temporary editor files."
+    relpath = Path(path).relative_to(get_dirpath())
+    if not relpath.parts or relpath.parts[0] == constants.CACHE:
+        return False
+    return not (relpath.name.startswith("#") or relpath.name.startswith(".#"))
+
+
+def apply(changes):
+    "Update the in-memory database for the changed files and directories."
+    reread = set()
+    for change, path in changes:
+        path = Path(path)
+        manifest.update(path)
+        relpath = path.relative_to(get_dirpath())
+        if len(relpath.parts) == 1:
+            if path == users.database.filepath:
+                if utils.get_stat(users.database.filepath) != users.database.stat:
+                    users.database.read()
+            elif path.is_dir() != (books.get_loaded_book(relpath.name) is not None):
+                reread.add(relpath.name)  # Added or removed book.
+            continue
+        id = relpath.parts[0]
+        if id in reread:
+            continue
+        book = books.get_loaded_book(id)
+        if book is None or not book.reload_path(path):
+            reread.add(id)
+    for id in reread:
+        books.reread_book(id)
+
+
+def run():
+    "Watch the data directory until stopped, applying the changes."
+    for changes in watchfiles.watch(
+        get_dirpath(),
+        watch_filter=watch_filter,
+        debounce=constants.WATCH_DEBOUNCE,
+        stop_event=_stop_event,
+    ):
+        # Do not let a bad file, e.g. saved halfway, stop the watcher.
+        try:
+            apply(sorted(changes, key=lambda c: c[1]))
+        except Exception as error:
+            print("Watcher error:", error)
+
+
+def start():
+    "Start the watcher thread, if enabled and not already started."
+    global _thread
+    if "WRITETHATBOOK_WATCH" not in os.environ or _thread is not None:
+        return
+    _thread = threading.Thread(target=run, daemon=True)
+    _thread.start()
+    atexit.register(stop)
+
+
+def stop():
+    "Stop the watcher thread, if started."
+    if _thread is None:
+        return
+    _stop_event.set()
+    _thread.join()